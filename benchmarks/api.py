@@ -0,0 +1,278 @@
+"""
+Benchmark the API hot paths in process
+
+Seeds a SQLite or Postgres database with users and tips, then measures
+throughput and p50/p95/p99 latency of /, /tips, /search, /token and
+/create. Rendering and S3 uploads are replaced by stubs that sleep for a
+configurable time. The listing and search caches are bypassed unless
+--cache is given, otherwise repeated pages measure cache hits instead of
+the queries. Results are written to a JSON file so runs can be compared
+across commits:
+
+    python -m benchmarks.api --tips 5000 --requests 500
+    make bench BENCH_ARGS="--db postgresql://localhost/codeimages_bench"
+
+Note: the database is dropped and recreated, never point it at real data.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+DEFAULT_DB = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'codeimages_bench.db')}"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+PASSWORD = "bench-pass"
+SEARCH_TERMS = ("dataclass", "f-string", "print", "lambda", "nonexistent")
+LANGUAGES = ("python", "javascript", "bash", "sql", "go")
+
+
+def _setup_env(args):
+    # tips.config reads the environment at import time
+    os.environ["DATABASE_URL"] = args.db
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("BASE_URL", "http://localhost:8000")
+    os.environ.setdefault("FROM_EMAIL", "bench@example.com")
+    os.environ.setdefault("ADMIN_EMAIL", "bench@example.com")
+    os.environ.setdefault("DEBUG", "False")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _snippet(rng):
+    lines = rng.randint(3, 60)
+    words = SEARCH_TERMS[:-1] + ("x", "y", "result", "return", "def", "for")
+    return "\n".join(
+        " ".join(rng.choice(words) for _ in range(rng.randint(2, 10)))
+        for _ in range(lines)
+    )
+
+
+def seed(engine, users, tips, rng):
+    from sqlmodel import SQLModel
+
+    from tips.db import _generate_activation_key, get_password_hash
+    from tips.models import Tip, User
+
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    # one bcrypt hash for everybody, hashing is what /token measures
+    hashed = get_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    user_rows = [
+        {
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "password": hashed,
+            "activation_key": _generate_activation_key(f"user{i}"),
+            "key_expires": now,
+            "verified": True,
+            "active": True,
+            "premium": True,
+            "premium_day_limit": 10**9,
+            "added": now,
+        }
+        for i in range(users)
+    ]
+    tip_rows = [
+        {
+            "title": f"tip {i}",
+            "code": _snippet(rng),
+            "description": f"description of tip {i}",
+            "language": rng.choice(LANGUAGES),
+            "background": "#ABB8C3",
+            "theme": "seti",
+            "wt": "sharp",
+            "user_id": rng.randint(1, users),
+            "public": True,
+            "added": now,
+            "url": f"https://bench.s3.amazonaws.com/tip{i}.png",
+        }
+        for i in range(tips)
+    ]
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), user_rows)
+        for start in range(0, len(tip_rows), 1000):
+            conn.execute(Tip.__table__.insert(), tip_rows[start : start + 1000])
+
+
+def fake_renderer(delay):
+    def create_code_image(code, **options):
+        time.sleep(delay)
+        with open(os.path.join(options["destination"], "carbon.png"), "wb") as f:
+            f.write(b"\x89PNG benchmark")
+
+    return create_code_image
+
+
+def fake_storage(delay):
+    def upload_to_s3(filepath, *args, **kwargs):
+        time.sleep(delay)
+        return f"https://bench.s3.amazonaws.com/{os.path.basename(filepath)}"
+
+    return upload_to_s3
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        # quantiles needs at least two data points
+        percentiles = latencies * 99
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p95_ms": round(percentiles[94] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def run_scenario(app, make_request, requests, concurrency):
+    """Fire requests with a client per worker thread, return the summary"""
+    from fastapi.testclient import TestClient
+
+    counter = itertools.count()
+    errors = []
+
+    def worker(_):
+        client = TestClient(app)
+        latencies = []
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            response = make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(
+            itertools.chain.from_iterable(executor.map(worker, range(concurrency)))
+        )
+    summary = summarize(latencies, time.perf_counter() - start)
+    summary["errors"] = len(errors)
+    return summary
+
+
+def main(args):
+    parser = argparse.ArgumentParser("Benchmark the API hot paths")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database URL (recreated!)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tips", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--render-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--upload-delay", type=float, default=0.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--cache", action="store_true", help="serve listings and searches from cache"
+    )
+    parser.add_argument(
+        "--endpoints",
+        nargs="+",
+        default=["/", "/tips", "/search", "/token", "/create"],
+    )
+    parser.add_argument("-o", "--output", help="results file (JSON)")
+    args = parser.parse_args(args)
+
+    _setup_env(args)
+    from tips.db import engine
+    from tips.main import app
+
+    rng = random.Random(args.seed)
+    seed(engine, args.users, args.tips, rng)
+
+    from fastapi.testclient import TestClient
+
+    client = TestClient(app)
+    tokens = [
+        client.post(
+            "/token", data={"username": f"user{i}", "password": PASSWORD}
+        ).json()["access_token"]
+        for i in range(args.users)
+    ]
+
+    def create(client, i):
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        payload = {"title": f"bench tip {i}", "code": _snippet(rng)}
+        return client.post("/create", json=payload, headers=headers)
+
+    scenarios = {
+        "/": lambda client, i: client.get("/", params={"offset": i % 10 * 100}),
+        "/tips": lambda client, i: client.get("/tips", params={"offset": i % 10 * 100}),
+        "/search": lambda client, i: client.post(
+            "/search", data={"term": SEARCH_TERMS[i % len(SEARCH_TERMS)]}
+        ),
+        "/token": lambda client, i: client.post(
+            "/token",
+            data={"username": f"user{i % args.users}", "password": PASSWORD},
+        ),
+        "/create": create,
+    }
+
+    results = {}
+    with ExitStack() as stack:
+        stack.enter_context(
+            patch("tips.render.create_code_image", fake_renderer(args.render_delay))
+        )
+        stack.enter_context(
+            patch("tips.render.upload_to_s3", fake_storage(args.upload_delay))
+        )
+        if not args.cache:
+            from tips.cache import listing_cache, search_cache
+
+            for cache in (listing_cache, search_cache):
+                stack.enter_context(patch.object(cache, "get", return_value=None))
+        for endpoint in args.endpoints:
+            results[endpoint] = run_scenario(
+                app, scenarios[endpoint], args.requests, args.concurrency
+            )
+            print(
+                "{:<10} {throughput_rps:>9} rps  p50 {p50_ms:>9} ms  "
+                "p95 {p95_ms:>9} ms  p99 {p99_ms:>9} ms  errors {errors}".format(
+                    endpoint, **results[endpoint]
+                )
+            )
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "database": engine.dialect.name,
+        "config": {k: v for k, v in vars(args).items() if k not in ("db", "output")},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
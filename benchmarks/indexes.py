@@ -0,0 +1,174 @@
+"""
+Compare insert and query timings of the index set before and after the
+e91b6c4d2f07 "rationalize indexes" migration
+
+For each variant the database is seeded (see benchmarks.api.seed), the
+indexes are set up like that revision left them, then single row tip
+inserts (one commit each, like /create) and the lookups the app does are
+timed:
+
+    python -m benchmarks.indexes --tips 20000 --inserts 2000
+    python -m benchmarks.indexes --db postgresql://localhost/codeimages_bench
+
+Note: the database is dropped and recreated, never point it at real data.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.api import (
+    RESULTS_DIR,
+    _git_commit,
+    _setup_env,
+    _snippet,
+    seed,
+    summarize,
+)
+
+DEFAULT_DB = (
+    f"sqlite:///{os.path.join(tempfile.gettempdir(), 'codeimages_bench_idx.db')}"
+)
+# indexes the initial migration created on big text columns
+BEFORE_ONLY = (
+    ("ix_tip_code", "tip", ["code"]),
+    ("ix_tip_description", "tip", ["description"]),
+    ("ix_tip_url", "tip", ["url"]),
+    ("ix_tip_theme", "tip", ["theme"]),
+    ("ix_tip_background", "tip", ["background"]),
+    ("ix_user_password", "user", ["password"]),
+)
+AFTER_ONLY = (
+    "ix_user_username",
+    "ix_user_email",
+    "ix_user_activation_key",
+    "ix_tip_user_id_title",
+    "ix_tip_added_id",
+)
+
+
+def apply_variant(engine, variant):
+    """Turn the (model, i.e. after) index set into the one before"""
+    from sqlalchemy import Index
+
+    from tips.models import Tip, User
+
+    if variant == "after":
+        return
+    tables = {"tip": Tip.__table__, "user": User.__table__}
+    with engine.begin() as conn:
+        for table in tables.values():
+            for index in list(table.indexes):
+                if index.name in AFTER_ONLY:
+                    index.drop(conn)
+        for name, table, columns in BEFORE_ONLY:
+            table = tables[table]
+            Index(name, *(table.c[column] for column in columns)).create(conn)
+
+
+def _time(fn, runs):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(runs):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_variant(engine, variant, args):
+    from sqlmodel import Session, select
+
+    from tips.db import get_all_tips, get_user_by_activation_key, get_user_by_username
+    from tips.models import Tip, User
+
+    rng = random.Random(args.seed)
+    seed(engine, args.users, args.tips, rng)
+    apply_variant(engine, variant)
+
+    with Session(engine) as session:
+        users = session.exec(select(User)).all()
+    keys = [user.activation_key for user in users]
+
+    def insert(i):
+        with Session(engine) as session:
+            session.add(
+                Tip(
+                    title=f"{variant} insert {i}",
+                    code=_snippet(rng),
+                    description=f"insert {i}",
+                    url=f"https://bench.s3.amazonaws.com/{variant}{i}.png",
+                    user_id=rng.randint(1, args.users),
+                )
+            )
+            session.commit()
+
+    results = {"insert": _time(insert, args.inserts)}
+    with Session(engine) as session:
+        queries = {
+            "user_by_username": lambda i: get_user_by_username(
+                session, f"user{i % args.users}"
+            ),
+            "user_by_activation_key": lambda i: get_user_by_activation_key(
+                session, keys[i % len(keys)]
+            ),
+            "tip_by_user_and_title": lambda i: session.exec(
+                select(Tip).where(
+                    Tip.user_id == i % args.users + 1, Tip.title == f"tip {i}"
+                )
+            ).first(),
+            "listing": lambda i: get_all_tips(session, i % 10 * 100, 100),
+        }
+        for name, query in queries.items():
+            results[name] = _time(query, args.queries)
+            # each lookup is its own unit of work, like a request
+            session.expunge_all()
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser("Benchmark the index set before/after")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database URL (recreated!)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--tips", type=int, default=10000)
+    parser.add_argument("--inserts", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500, help="per query")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", help="results file (JSON)")
+    args = parser.parse_args(args)
+
+    _setup_env(args)
+    from tips.db import engine
+
+    results = {}
+    for variant in ("before", "after"):
+        results[variant] = run_variant(engine, variant, args)
+
+    print(f"{'':<24}{'before p50 ms':>15}{'after p50 ms':>15}{'change':>10}")
+    for name, before in results["before"].items():
+        after = results["after"][name]
+        change = (after["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        print(f"{name:<24}{before['p50_ms']:>15}{after['p50_ms']:>15}{change:>9.0f}%")
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "database": engine.dialect.name,
+        "config": {k: v for k, v in vars(args).items() if k not in ("db", "output")},
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}-indexes.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
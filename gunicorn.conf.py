@@ -0,0 +1,22 @@
+# gunicorn settings, loaded by the Procfile web process
+import os
+import shutil
+import tempfile
+
+# every worker writes its Prometheus samples here, /metrics aggregates them
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "codeimages_prometheus"),
+)
+
+
+def on_starting(server):
+    # start clean, samples of a previous run would be counted again
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,42 @@
+"""unique tip title per user
+
+create_tip relies on this index instead of looking the title up first.
+Fails on existing duplicates, check first with:
+SELECT user_id, title, count(*) FROM tip GROUP BY 1, 2 HAVING count(*) > 1
+
+Revision ID: 5d8e2b7f1a64
+Revises: e91b6c4d2f07
+Create Date: 2026-10-19 14:20:48.530291
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5d8e2b7f1a64"
+down_revision = "e91b6c4d2f07"
+branch_labels = None
+depends_on = None
+
+
+def _replace_index(unique):
+    # CONCURRENTLY on postgres, so no transaction
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_tip_user_id_title", table_name="tip", postgresql_concurrently=True
+        )
+        op.create_index(
+            "ix_tip_user_id_title",
+            "tip",
+            ["user_id", "title"],
+            unique=unique,
+            postgresql_concurrently=True,
+        )
+
+
+def upgrade():
+    _replace_index(unique=True)
+
+
+def downgrade():
+    _replace_index(unique=False)
@@ -0,0 +1,26 @@
+"""add tip listing indexes
+
+Revision ID: 7c1f3a8e5d20
+Revises: 4b7d2e9a1c35
+Create Date: 2026-10-19 13:02:17.904412
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "7c1f3a8e5d20"
+down_revision = "4b7d2e9a1c35"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # language= and user= filtered listings, ordered by added desc
+    op.create_index("ix_tip_language_added", "tip", ["language", "added"])
+    op.create_index("ix_tip_user_id_added", "tip", ["user_id", "added"])
+
+
+def downgrade():
+    op.drop_index("ix_tip_user_id_added", table_name="tip")
+    op.drop_index("ix_tip_language_added", table_name="tip")
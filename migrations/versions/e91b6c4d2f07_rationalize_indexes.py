@@ -0,0 +1,62 @@
+"""rationalize indexes
+
+Drop the indexes on big text columns that no query filters on (some
+databases still have them from the initial migration) and add the ones
+the queries need. On Postgres indexes are created and dropped
+CONCURRENTLY so writes aren't blocked, which can't run in a transaction.
+
+The unique username/email indexes fail on existing duplicates, check
+first with: SELECT username, count(*) FROM "user" GROUP BY 1 HAVING count(*) > 1
+
+Revision ID: e91b6c4d2f07
+Revises: 7c1f3a8e5d20
+Create Date: 2026-10-19 13:41:05.112873
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "e91b6c4d2f07"
+down_revision = "7c1f3a8e5d20"
+branch_labels = None
+depends_on = None
+
+USELESS_INDEXES = (
+    "ix_tip_code",
+    "ix_tip_description",
+    "ix_tip_url",
+    "ix_tip_theme",
+    "ix_tip_background",
+    "ix_user_password",
+)
+# name, table, columns, unique
+INDEXES = (
+    ("ix_user_username", "user", ["username"], True),
+    ("ix_user_email", "user", ["email"], True),
+    ("ix_user_activation_key", "user", ["activation_key"], False),
+    ("ix_tip_user_id_title", "tip", ["user_id", "title"], False),
+    ("ix_tip_added_id", "tip", ["added", "id"], False),
+)
+
+
+def _concurrently():
+    return "CONCURRENTLY " if op.get_context().dialect.name == "postgresql" else ""
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name in USELESS_INDEXES:
+            op.execute(f"DROP INDEX {_concurrently()}IF EXISTS {name}")
+        for name, table, columns, unique in INDEXES:
+            # leftovers with the same name aren't unique
+            op.execute(f"DROP INDEX {_concurrently()}IF EXISTS {name}")
+            op.create_index(
+                name, table, columns, unique=unique, postgresql_concurrently=True
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, *_ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -18,9 +18,36 @@ function turnOffDarkMode(){
 }
 
 
+// popularity counters, beacons survive navigating away (downloads)
+function recordEvent(element, event){
+  const tipId = $(element).closest('.card').data('tipId');
+  if(tipId && navigator.sendBeacon){
+    navigator.sendBeacon(`/tips/${tipId}/events/${event}`);
+  }
+}
+
+
 $(function() {
 
+  // count a view once a tip is half on screen, once per page load
+  if('IntersectionObserver' in window){
+    const observer = new IntersectionObserver(function(entries) {
+      entries.forEach(entry => {
+        if(entry.isIntersecting){
+          recordEvent(entry.target, 'views');
+          observer.unobserve(entry.target);
+        }
+      });
+    }, {threshold: 0.5});
+    document.querySelectorAll('.card[data-tip-id]').forEach(card => observer.observe(card));
+  }
+
+  $('.downloadImage').click(function() {
+    recordEvent(this, 'downloads');
+  })
+
   $('.copyCode').click(function() {
+    recordEvent(this, 'copies');
     let copyText = $(this).siblings()[1].innerText;
     let codeImg = $(this).parent().parent().siblings()[1];
     // https://stackoverflow.com/a/67758578
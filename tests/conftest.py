@@ -4,7 +4,10 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
-from tips.main import app, get_session
+from tips.cache import listing_cache, search_cache, search_stats
+from tips.main import app, get_read_session, get_session
+from tips.stats import stats_buffer
+from tips.suggest import suggest_index
 
 
 @pytest.fixture(name="session")
@@ -13,7 +16,8 @@ def session_fixture():
         "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
     )
     SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+    # like db.get_session
+    with Session(engine, expire_on_commit=False) as session:
         yield session
 
 
@@ -23,6 +27,12 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    listing_cache.clear()
+    search_cache.clear()
+    search_stats.clear()
+    suggest_index.clear()
+    stats_buffer.clear()
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
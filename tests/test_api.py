@@ -1,16 +1,36 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import os
 from unittest.mock import patch, MagicMock
 
 import pytest
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from sqlmodel import Session, select
 
-from tips.db import get_password_hash, _generate_activation_key
-from tips.models import User, Tip
+from tips.aws import s3_url
+from tips.cache import bump_generation
+from tips.db import (
+    get_all_tips,
+    get_password_hash,
+    hash_code,
+    _generate_activation_key,
+)
+from tips.models import IdempotencyKey, User, Tip, TipCreate, TipStats
+from tips.render import RenderLane
+from tips.stats import stats_buffer
 
 S3_FAKE_URL = "https://carbon-bucket.s3.us-east-2.amazonaws.com/beautiful-code.png"
 
 
+def fake_carbon(code, destination, **options):
+    with open(os.path.join(destination, "carbon.png"), "wb") as f:
+        f.write(b"png")
+
+
 @pytest.fixture(name="user")
 def user1(session: Session):
     encrypted_pw = get_password_hash("some_pass1")
@@ -271,11 +291,9 @@ def test_create_tip_logged_out(user: User, client: TestClient):
     assert response.json()["detail"] == "Not authenticated"
 
 
-@patch("tips.main.create_code_image")
-@patch("tips.main.upload_to_s3", side_effect=[S3_FAKE_URL])
-@patch("tips.main.os")
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", side_effect=[S3_FAKE_URL])
 def test_create_tip_logged_in(
-    os_mock: MagicMock,
     s3_mock: MagicMock,
     carbon_mock: MagicMock,
     session: Session,
@@ -286,7 +304,6 @@ def test_create_tip_logged_in(
     This test mocks out external dependencies in the create_tip endpoint.
     1. pybites-carbon tool that uses selenium to make the image on carbon.now.sh
     2. aws code to upload image to S3
-    3. os module stuff
     """
     headers = {"Authorization": f"Bearer {token}"}
     response = client.post(
@@ -300,9 +317,11 @@ def test_create_tip_logged_in(
     )
     assert response.status_code == 201
 
-    tmp_path = "/tmp/1"
-    os_mock.makedirs.assert_called_with(tmp_path, exist_ok=True)
-    os_mock.rmdir.assert_called_with(tmp_path)
+    # rendered in its own scratch dir, removed afterwards
+    (uploaded,) = s3_mock.call_args.args
+    workdir = os.path.dirname(uploaded)
+    assert os.path.basename(workdir).startswith("codeimages-")
+    assert not os.path.exists(workdir)
 
     tip = session.exec(select(Tip)).one()
     assert tip.description == "some description"
@@ -315,6 +334,232 @@ def test_create_tip_logged_in(
     assert tip.theme == "seti"
     assert tip.public is True
     assert tip.user_id == 1
+    assert tip.code_hash == hash_code("print('hello world')")
+    # listed by sort=popular before any event is counted
+    assert session.get(TipStats, tip.id) == TipStats(tip_id=tip.id)
+
+    server_timing = response.headers["Server-Timing"]
+    stages = [metric.split(";")[0] for metric in server_timing.split(", ")]
+    assert stages == [
+        "quota",
+        "title",
+        "duplicate",
+        "queue",
+        "render",
+        "rename",
+        "upload",
+        "insert",
+        "commit",
+    ]
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", side_effect=ConnectionError("S3 down"))
+def test_create_tip_failure_tagged_by_stage(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+):
+    def failures(stage):
+        return (
+            REGISTRY.get_sample_value(
+                "codeimages_create_tip_stage_failures_total", {"stage": stage}
+            )
+            or 0
+        )
+
+    before = failures("upload")
+    headers = {"Authorization": f"Bearer {token}"}
+    with pytest.raises(ConnectionError):
+        client.post(
+            "/create",
+            json={"title": "hello world", "code": "print('hello world')"},
+            headers=headers,
+        )
+    assert failures("upload") == before + 1
+    assert failures("render") == 0
+
+    # scratch dir cleaned up on failure too
+    (uploaded,) = s3_mock.call_args.args
+    assert not os.path.exists(os.path.dirname(uploaded))
+
+    # nothing is written before the image is uploaded
+    assert session.exec(select(Tip)).all() == []
+
+
+@pytest.mark.parametrize(
+    "code, error",
+    [
+        ("print()\n" * 501, "Code can have at most 500 lines"),
+        ("x" * 301, "Code lines can be at most 300 characters"),
+        (("ü" * 150 + "\n") * 101, "Code can be at most 30000 bytes"),
+    ],
+    ids=["lines", "line length", "bytes"],
+)
+def test_create_tip_over_render_limits(client: TestClient, token: str, code, error):
+    response = client.post(
+        "/create",
+        json={"title": "too big", "code": code},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["msg"] == error
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=S3_FAKE_URL)
+@patch("tips.main.RENDER_QUEUE_TIMEOUT", 0.01)
+def test_create_tip_render_lane_busy(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+):
+    # e.g. held by a big render of another request
+    with patch("tips.render.SLOW_LANE", RenderLane("slow", 1)) as lane:
+        lane.acquire()
+        response = client.post(
+            "/create",
+            json={"title": "big one", "code": "print()\n" * 100},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 503
+        assert session.exec(select(Tip)).all() == []
+
+        # small snippets render in the fast lane
+        response = client.post(
+            "/create",
+            json={"title": "small one", "code": "print()"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 201
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=S3_FAKE_URL)
+def test_create_tip_idempotency_key(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+):
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "abc"}
+    payload = {"title": "hello world", "code": "print('hello world')"}
+    first = client.post("/create", json=payload, headers=headers)
+    assert first.status_code == 201
+
+    # a retry gets the stored response, no new render
+    retry = client.post("/create", json=payload, headers=headers)
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert carbon_mock.call_count == s3_mock.call_count == 1
+    assert len(session.exec(select(Tip)).all()) == 1
+
+    other = dict(payload, title="other")
+    response = client.post("/create", json=other, headers=headers)
+    assert response.status_code == 422
+
+    # refusals are stored too
+    headers["Idempotency-Key"] = "def"
+    for _ in range(2):
+        response = client.post("/create", json=payload, headers=headers)
+        assert response.status_code == 400
+        assert response.json() == {"detail": "You already posted this tip"}
+    assert "Idempotent-Replayed" in response.headers
+
+    # expired keys can be used again
+    key = session.get(IdempotencyKey, (1, "abc"))
+    assert key is not None
+    key.expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+    session.commit()
+    headers["Idempotency-Key"] = "abc"
+    response = client.post("/create", json=other, headers=headers)
+    assert response.status_code == 201
+    assert response.json()["title"] == "other"
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", side_effect=ConnectionError("S3 down"))
+def test_create_tip_idempotency_key_released_on_error(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+    verified_user: User,
+):
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "abc"}
+    payload = {"title": "hello world", "code": "print('hello world')"}
+    with pytest.raises(ConnectionError):
+        client.post("/create", json=payload, headers=headers)
+    assert session.exec(select(IdempotencyKey)).all() == []
+
+    s3_mock.side_effect = None
+    s3_mock.return_value = S3_FAKE_URL
+    assert client.post("/create", json=payload, headers=headers).status_code == 201
+
+    # still rendering in another request
+    other = TipCreate(title="other", code="print('hello world')")
+    claim = IdempotencyKey(
+        user_id=verified_user.id,
+        key="in-progress",
+        request_hash=hashlib.sha256(other.json(sort_keys=True).encode()).hexdigest(),
+        expires=datetime.now(timezone.utc) + timedelta(seconds=60),
+    )
+    session.add(claim)
+    session.commit()
+    headers["Idempotency-Key"] = "in-progress"
+    response = client.post("/create", json=other.dict(), headers=headers)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "5"
+    response = client.post("/create", json=payload, headers=headers)
+    assert response.status_code == 422
+
+    # the lease ran out, the worker handling it died, a retry takes over
+    claim.expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+    session.commit()
+    response = client.post("/create", json=other.dict(), headers=headers)
+    assert response.status_code == 201
+    session.expire_all()
+    taken_over = session.get(IdempotencyKey, (verified_user.id, "in-progress"))
+    assert taken_over is not None
+    assert taken_over.status_code == 201
+    # the response is kept for IDEMPOTENCY_KEY_TTL, not the lease
+    expires = taken_over.expires.replace(tzinfo=timezone.utc)
+    assert expires > datetime.now(timezone.utc) + timedelta(hours=23)
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=S3_FAKE_URL)
+def test_create_tip_idempotency_key_released_on_failed_commit(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+):
+    def fail_stats_insert(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO tip_stats"):
+            raise OperationalError(statement, None, Exception("disk I/O error"))
+
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": "abc"}
+    payload = {"title": "hello world", "code": "print('hello world')"}
+    event.listen(session.bind, "before_cursor_execute", fail_stats_insert)
+    try:
+        with patch("tips.main.delete_queue"), pytest.raises(OperationalError):
+            client.post("/create", json=payload, headers=headers)
+    finally:
+        event.remove(session.bind, "before_cursor_execute", fail_stats_insert)
+    assert session.exec(select(IdempotencyKey)).all() == []
+    assert session.exec(select(Tip)).all() == []
+
+    # a retry runs again instead of waiting out the lease
+    assert client.post("/create", json=payload, headers=headers).status_code == 201
 
 
 def test_create_tip_out_of_credits(
@@ -372,6 +617,97 @@ def test_create_tip_cannot_same_one_twice(
     assert response.json() == {"detail": "You already posted this tip"}
 
 
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=s3_url("raced.png"))
+def test_create_tip_title_taken_while_rendering(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    user: User,
+    token: str,
+):
+    def concurrent_create(*args, **kwargs):
+        # no transaction of the request is open while rendering
+        session.add(Tip(title="hello world", code="print(1)", user_id=user.id))
+        session.commit()
+        return fake_carbon(*args, **kwargs)
+
+    carbon_mock.side_effect = concurrent_create
+    with patch("tips.main.delete_queue") as delete_queue:
+        response = client.post(
+            "/create",
+            json={"title": "hello world", "code": "print('hello world')"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    assert response.status_code == 400
+    assert response.json() == {"detail": "You already posted this tip"}
+    # the image rendered for nothing is removed
+    delete_queue.put.assert_called_once_with(
+        "raced.png", hash_code("print('hello world')")
+    )
+    assert len(session.exec(select(Tip)).all()) == 1
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", side_effect=[S3_FAKE_URL])
+def test_create_tip_duplicate_code_links_image(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    tip_other_user: Tip,
+    token: str,
+):
+    tip_other_user.url = "https://carbon-bucket.s3.amazonaws.com/existing.png"
+    tip_other_user.code_hash = hash_code(tip_other_user.code)
+    session.add(tip_other_user)
+    session.commit()
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/create",
+        # same code modulo whitespace
+        json={"title": "my debugging tip", "code": "\n    f'{var=}')   \n"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert response.json()["url"] == tip_other_user.url
+    carbon_mock.assert_not_called()
+    s3_mock.assert_not_called()
+
+    # different theme, different image
+    response = client.post(
+        "/create",
+        json={"title": "my dark tip", "code": "f'{var=}')", "theme": "dracula"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert response.json()["url"] == S3_FAKE_URL
+    carbon_mock.assert_called_once()
+
+    tips = session.exec(select(Tip).where(Tip.code_hash == hash_code("f'{var=}')")))
+    assert len(tips.all()) == 3
+
+
+@patch("tips.main.DUPLICATE_CODE_POLICY", "reject")
+def test_create_tip_duplicate_code_rejected(
+    session: Session, client: TestClient, tip_other_user: Tip, token: str
+):
+    tip_other_user.code_hash = hash_code(tip_other_user.code)
+    session.add(tip_other_user)
+    session.commit()
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/create",
+        json={"title": "my debugging tip", "code": "f'{var=}')"},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert response.json() == {"detail": "This code snippet was already posted"}
+
+
 def test_delete_tip(client: TestClient, tip: Tip, token: str):
     headers = {"Authorization": f"Bearer {token}"}
     response = client.delete(
@@ -382,6 +718,88 @@ def test_delete_tip(client: TestClient, tip: Tip, token: str):
     assert response.json() == {"ok": True}
 
 
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=S3_FAKE_URL)
+def test_delete_newest_tip_then_create(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    session: Session,
+    client: TestClient,
+    token: str,
+):
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"title": "hello world", "code": "print('hello world')"}
+    tip_id = client.post("/create", json=payload, headers=headers).json()["id"]
+    with patch("tips.main.delete_queue"):
+        assert client.delete(f"/{tip_id}", headers=headers).status_code == 200
+    assert session.get(TipStats, tip_id) is None
+
+    # SQLite hands out the same id again
+    payload["title"] = "hello again"
+    response = client.post("/create", json=payload, headers=headers)
+    assert response.status_code == 201
+    assert response.json()["id"] == tip_id
+    assert session.get(TipStats, tip_id) == TipStats(tip_id=tip_id)
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", return_value=S3_FAKE_URL)
+def test_suggest(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    client: TestClient,
+    tip: Tip,
+    tip_other_user: Tip,
+    token: str,
+):
+    response = client.get("/suggest", params={"q": "F-"})
+    assert response.json() == [{"text": "f-string debugging", "kind": "title"}]
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/create",
+        json={"title": "f-strings", "code": "f'{x:>10}'", "language": "Python"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    response = client.get("/suggest", params={"q": "f-"})
+    assert [row["text"] for row in response.json()] == [
+        "f-string debugging",
+        "f-strings",
+    ]
+
+    response = client.delete(f"/{tip_other_user.id}", headers=headers)
+    assert response.status_code == 404
+    response = client.delete(f"/{tip.id}", headers=headers)
+    assert response.status_code == 200
+    response = client.get("/suggest", params={"q": "hello", "limit": 5})
+    assert response.json() == []
+
+    # the search box's datalist
+    response = client.get("/suggest", params={"q": "j"}, headers={"HX-Request": "true"})
+    assert response.text.strip() == '<option value="julian" label="user"></option>'
+
+
+def test_delete_tip_deletes_image_unless_shared(
+    session: Session, client: TestClient, tip: Tip, token: str
+):
+    tip.url = s3_url("hello.png")
+    tip.code_hash = hash_code(tip.code)
+    # a linked duplicate showing the same image
+    session.add(Tip(title="copy", code=tip.code, code_hash=tip.code_hash, url=tip.url))
+    session.add(Tip(title="other", code="1", url=s3_url("other.png"), user=tip.user))
+    session.commit()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with patch("tips.main.delete_queue") as queue_mock:
+        assert client.delete(f"/{tip.id}", headers=headers).status_code == 200
+        queue_mock.put.assert_not_called()
+
+        other = session.exec(select(Tip).where(Tip.title == "other")).one()
+        assert client.delete(f"/{other.id}", headers=headers).status_code == 200
+        queue_mock.put.assert_called_once_with("other.png", None)
+
+
 def test_delete_tip_loggedout(client: TestClient):
     response = client.delete("/1")
     assert response.status_code == 401
@@ -452,3 +870,262 @@ def test_search(tip: Tip, tip_other_user: Tip, client: TestClient):
     assert response.text.count("<h2>") == 1
     assert "f-string debugging" in response.text
     assert "hello world" not in response.text
+
+
+@pytest.fixture(name="bash_tip")
+def bash_tip(session: Session, user: User):
+    tip = Tip(
+        title="list files",
+        code="ls -lrt",
+        language="bash",
+        user=user,
+    )
+    session.add(tip)
+    session.commit()
+    yield tip
+    session.delete(tip)
+
+
+def test_get_tips_filtered(
+    tip: Tip, tip_other_user: Tip, bash_tip: Tip, client: TestClient
+):
+    response = client.get("/tips", params={"language": "Bash"})
+    assert [row["title"] for row in response.json()] == ["list files"]
+
+    response = client.get("/tips", params={"user": "bob"})
+    assert [row["title"] for row in response.json()] == ["list files", "hello world"]
+
+    response = client.get("/tips", params={"user": "bob", "language": "python"})
+    assert [row["title"] for row in response.json()] == ["hello world"]
+
+    response = client.get("/tips", params={"user": "nobody"})
+    assert response.json() == []
+
+    response = client.get("/", params={"user": "julian"})
+    assert response.text.count("<h2>") == 1
+    assert "f-string debugging" in response.text
+    assert 'href="/?language=python"' in response.text
+
+
+def test_export_tips(
+    session: Session, tip: Tip, tip_other_user: Tip, client: TestClient
+):
+    tip.added = datetime(2022, 1, 1)
+    tip_other_user.added = datetime(2022, 2, 1)
+    session.add(Tip(title="private", code="1", public=False, user=tip.user))
+    session.commit()
+
+    response = client.get("/tips/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["title"], row["username"]) for row in rows] == [
+        ("hello world", "bob"),
+        ("f-string debugging", "julian"),
+    ]
+
+    response = client.get(
+        "/tips/export", params={"format": "csv", "since": "2022-01-15T00:00:00"}
+    )
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines()[1].startswith("f-string debugging,")
+    assert len(response.text.splitlines()) == 2
+
+    assert client.get("/tips/export", params={"format": "xml"}).status_code == 422
+
+
+def test_popular_tips(
+    session: Session, tip: Tip, tip_other_user: Tip, bash_tip: Tip, client: TestClient
+):
+    events = [
+        (tip.id, "views"),
+        (tip.id, "views"),
+        (tip_other_user.id, "copies"),
+        (bash_tip.id, "views"),
+        (bash_tip.id, "downloads"),
+        (999, "copies"),
+    ]
+    for tip_id, kind in events:
+        response = client.post(f"/tips/{tip_id}/events/{kind}")
+        assert response.status_code == 204
+    assert client.post(f"/tips/{tip.id}/events/likes").status_code == 422
+
+    assert stats_buffer.flush(session.get_bind()) == 3
+    # the test client sends no address, nothing to tell its requests apart
+    stats = session.get(TipStats, tip.id)
+    assert stats is not None
+    assert stats.views == 2
+    # repeats from the client the router saw are counted once
+    for forwarded in ("1.2.3.4, 5.6.7.8", "9.9.9.9, 5.6.7.8", "1.2.3.4, 6.6.6.6"):
+        headers = {"X-Forwarded-For": forwarded}
+        client.post(f"/tips/{tip.id}/events/views", headers=headers)
+    assert stats_buffer.flush(session.get_bind()) == 1
+    session.expire_all()
+    stats = session.get(TipStats, tip.id)
+    assert stats is not None
+    assert stats.views == 4
+    response = client.get("/tips", params={"sort": "popular"})
+    assert [row["title"] for row in response.json()] == [
+        "list files",
+        "f-string debugging",
+        "hello world",
+    ]
+    response = client.get("/users/bob/tips", params={"sort": "popular"})
+    assert [row["title"] for row in response.json()] == ["list files", "hello world"]
+    assert client.get("/tips", params={"sort": "random"}).status_code == 422
+
+
+def test_get_user_tips(tip: Tip, tip_other_user: Tip, client: TestClient):
+    response = client.get("/users/julian/tips")
+    assert response.status_code == 200
+    assert [row["title"] for row in response.json()] == ["f-string debugging"]
+
+    response = client.get("/users/nobody/tips")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "User not found"}
+
+
+@pytest.mark.parametrize(
+    "filters, index",
+    [
+        ({"language": "python"}, "ix_tip_language_added"),
+        ({"username": "bob"}, "ix_tip_user_id_added"),
+        ({"sort": "popular"}, "ix_tip_stats_score"),
+    ],
+)
+def test_filtered_listing_uses_index(session: Session, filters, index):
+    statements = []
+
+    @event.listens_for(session.bind, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT tip."):
+            statements.append((statement, parameters))
+
+    try:
+        get_all_tips(session, 0, 10, **filters)
+    finally:
+        event.remove(session.bind, "before_cursor_execute", capture)
+
+    (statement, parameters), *_ = statements
+    plan = " ".join(
+        row[-1]
+        for row in session.connection().exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        )
+    )
+    assert index in plan
+    # walks the index backwards instead of sorting the table
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(session: Session):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(session.bind, "before_cursor_execute", capture)
+    yield statements
+    event.remove(session.bind, "before_cursor_execute", capture)
+
+
+def test_signup_single_insert(client: TestClient, statements: list):
+    response = client.post(
+        "/users/",
+        json={
+            "username": "bob",
+            "email": "bob@pybit.es",
+            "password": "some_pass1",
+            "password2": "some_pass1",
+        },
+    )
+    assert response.status_code == 201
+    # no lookups before nor refresh after the insert
+    assert [statement.split()[0] for statement in statements] == ["INSERT"]
+
+
+@patch("tips.render.create_code_image", side_effect=fake_carbon)
+@patch("tips.render.upload_to_s3", side_effect=[S3_FAKE_URL])
+def test_create_tip_statements(
+    s3_mock: MagicMock,
+    carbon_mock: MagicMock,
+    client: TestClient,
+    token: str,
+    statements: list,
+):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/create",
+        json={"title": "hello world", "code": "print('hello world')"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert response.json()["url"] == S3_FAKE_URL
+    # current user, quota, title, duplicate code, then write the tip and
+    # its zero stats row without refresh
+    assert [statement.split()[0] for statement in statements] == [
+        "SELECT",
+        "SELECT",
+        "SELECT",
+        "SELECT",
+        "INSERT",
+        "INSERT",
+    ]
+
+
+@pytest.mark.parametrize(
+    "request_listing",
+    [
+        lambda client: client.get("/"),
+        lambda client: client.get("/tips"),
+        lambda client: client.post("/search", data={"term": "tip"}),
+    ],
+    ids=["/", "/tips", "/search"],
+)
+def test_listing_loads_authors_in_one_statement(
+    session: Session, client: TestClient, statements: list, request_listing
+):
+    for name in ("bob", "julian", "sara"):
+        user = User(username=name, email=f"{name}@pybit.es", password="hashed")
+        session.add(Tip(title=f"tip by {name}", code="x = 1", user=user))
+    session.commit()
+    # start from an empty identity map, like a fresh request
+    session.expunge_all()
+    statements.clear()
+
+    response = request_listing(client)
+    assert response.status_code == 200
+
+    tips_query, users_query = statements
+    assert tips_query.startswith("SELECT tip.")
+    assert users_query.startswith("SELECT user.id AS user_id, user.username")
+    assert "password" not in users_query
+    assert " IN (" in users_query
+
+
+def test_search_cached_per_term_and_page(
+    session: Session, client: TestClient, tip: Tip, tip_other_user: Tip
+):
+    results = set()
+    for term in ("  F-String ", "f-string", "f-string", "hello"):
+        response = client.post("/search", data={"term": term})
+        assert response.status_code == 200
+        if "string" in term.lower():
+            results.add(response.text.count("<h2>"))
+    # all spellings query and cache the same normalized term
+    assert results == {1}
+    assert client.post("/search?offset=1", data={"term": "hello"}).status_code == 200
+
+    response = client.get("/search/stats")
+    assert response.json() == [
+        {"term": "f-string", "searches": 3, "hits": 2, "misses": 1},
+        {"term": "hello", "searches": 2, "hits": 0, "misses": 2},
+    ]
+
+    # a new tip invalidates the cached results
+    session.add(Tip(title="more f-string", code="f'{x!r}'", user=tip.user))
+    session.commit()
+    bump_generation()
+    response = client.post("/search", data={"term": "f-string"})
+    assert response.text.count("<h2>") == 2
@@ -0,0 +1,105 @@
+import gzip
+import json
+
+import brotli
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tips.assets import (
+    AssetFiles,
+    asset_path,
+    build,
+    load_manifest,
+    parse_accept_encoding,
+)
+
+CSS = b"body { margin: 0; }\n" * 50
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "style.css").write_bytes(CSS)
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "copy.png").write_bytes(b"\x89PNG fake")
+    yield tmp_path
+    load_manifest.cache_clear()
+
+
+@pytest.fixture
+def assets_client(static_dir):
+    build(str(static_dir))
+    app = FastAPI()
+    app.mount("/static", AssetFiles(directory=str(static_dir)), name="static")
+    return TestClient(app)
+
+
+def test_build(static_dir):
+    manifest = build(str(static_dir))
+    assert set(manifest) == {"css/style.css", "img/copy.png"}
+
+    hashed_css = manifest["css/style.css"]
+    assert hashed_css.startswith("dist/css/style.") and hashed_css.endswith(".css")
+    dist_css = static_dir / hashed_css
+    assert dist_css.read_bytes() == CSS
+    assert gzip.decompress((static_dir / f"{hashed_css}.gz").read_bytes()) == CSS
+    assert brotli.decompress((static_dir / f"{hashed_css}.br").read_bytes()) == CSS
+
+    # images are not worth compressing
+    assert not (static_dir / f"{manifest['img/copy.png']}.gz").exists()
+
+    written = json.loads((static_dir / "dist" / "manifest.json").read_text())
+    assert written == manifest
+
+    # rebuilding does not fingerprint the previous build output
+    assert build(str(static_dir)) == manifest
+
+
+def test_asset_path(static_dir):
+    manifest = build(str(static_dir))
+    assert (
+        asset_path("/css/style.css", str(static_dir)) == "/" + manifest["css/style.css"]
+    )
+    assert asset_path("/js/unknown.js", str(static_dir)) == "/js/unknown.js"
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip, deflate, br", {"gzip", "deflate", "br"}),
+        ("br;q=0, gzip;q=0.5", {"gzip"}),
+        ("", set()),
+    ],
+)
+def test_parse_accept_encoding(header, expected):
+    assert parse_accept_encoding(header) == expected
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+def test_serve_precompressed(assets_client, static_dir, encoding):
+    hashed = load_manifest(str(static_dir))["css/style.css"]
+    response = assets_client.get(
+        f"/static/{hashed}", headers={"Accept-Encoding": encoding}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["content-type"].startswith("text/css")
+    assert "immutable" in response.headers["cache-control"]
+    assert response.content == CSS
+
+
+def test_serve_identity(assets_client, static_dir):
+    hashed = load_manifest(str(static_dir))["css/style.css"]
+    response = assets_client.get(
+        f"/static/{hashed}", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    assert "immutable" in response.headers["cache-control"]
+    assert response.content == CSS
+
+
+def test_unhashed_files_not_immutable(assets_client):
+    response = assets_client.get("/static/css/style.css")
+    assert response.status_code == 200
+    assert "cache-control" not in response.headers
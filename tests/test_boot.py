@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+from tips.boot import parse_importtime
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       298 |        298 |   _io
+import time:       120 |        200 |     tips.config
+import time:       300 |        500 |   tips.db
+import time:      1000 |       1500 | tips.main
+"""
+
+
+def test_parse_importtime():
+    assert parse_importtime(IMPORTTIME_OUTPUT) == [
+        ("_io", 298, 298, 1),
+        ("tips.config", 120, 200, 2),
+        ("tips.db", 300, 500, 1),
+        ("tips.main", 1000, 1500, 0),
+    ]
+
+
+def test_heavy_dependencies_imported_lazily():
+    code = (
+        "import sys, tips.main; "
+        "print(sorted(m for m in ('boto3', 'sendgrid', 'selenium', 'carbon', "
+        "'passlib') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,202 @@
+from datetime import datetime
+import json
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from tips.aws import s3_url
+from tips.bulk import export_tips, import_tips, main, stream_export
+from tips.db import hash_code
+from tips.models import Tip, TipStats, User
+
+
+def _engine():
+    engine = create_engine("sqlite:///")
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def source_engine():
+    engine = _engine()
+    with Session(engine) as session:
+        bob = User(username="bob", email="bob@pybit.es", password="hashed")
+        julian = User(username="julian", email="julian@pybit.es", password="hashed")
+        for i in range(5):
+            session.add(
+                Tip(
+                    title=f"tip {i}",
+                    code=f"print({i})",
+                    url=f"https://bucket.s3.amazonaws.com/{i}.png",
+                    added=datetime(2022, 1, i + 1),
+                    user=bob if i % 2 == 0 else julian,
+                )
+            )
+        session.commit()
+    return engine
+
+
+@pytest.fixture
+def target_engine():
+    engine = _engine()
+    with Session(engine) as session:
+        session.add(User(username="bob", email="bob@pybit.es", password="hashed"))
+        session.commit()
+    return engine
+
+
+def test_export(source_engine, tmp_path, capfd):
+    output = tmp_path / "tips.ndjson"
+    main(["export", "-o", str(output), "--since", "2022-01-02"], engine=source_engine)
+
+    lines = output.read_text().splitlines()
+    assert len(lines) == 4
+    first = json.loads(lines[0])
+    assert first["title"] == "tip 1"
+    assert first["username"] == "julian"
+    assert first["added"] == "2022-01-02T00:00:00"
+    assert "id" not in first and "user_id" not in first
+    assert "Exported 4 tips" in capfd.readouterr().err
+
+
+def test_stream_export_chunks(source_engine):
+    with Session(source_engine) as session:
+        session.get(Tip, 5).public = False
+        session.commit()
+
+    chunks = list(stream_export(source_engine, "csv", fetch_size=2))
+    # header + 2 rows, then the remaining 2 rows
+    assert [chunk.count("\n") for chunk in chunks] == [3, 2]
+    lines = "".join(chunks).splitlines()
+    assert lines[0] == (
+        "title,code,description,language,background,theme,wt,public,added,url,username"
+    )
+    assert lines[1].startswith("tip 0,print(0),,python,")
+    assert lines[-1].endswith(",julian")
+    assert "tip 4" not in "".join(chunks)
+
+
+def test_roundtrip(source_engine, target_engine, tmp_path, capfd):
+    export_file = tmp_path / "tips.ndjson"
+    with open(export_file, "w") as f:
+        export_tips(source_engine, f, fetch_size=2)
+
+    main(["import", str(export_file), "--batch-size", "2"], engine=target_engine)
+    output = capfd.readouterr().out
+    assert "Imported 3 tips" in output
+    assert "Skipped line 2: unknown user 'julian'" in output
+    assert "Skipped line 4: unknown user 'julian'" in output
+
+    with Session(target_engine) as session:
+        tips = session.exec(select(Tip).order_by(Tip.id)).all()
+    assert [tip.title for tip in tips] == ["tip 0", "tip 2", "tip 4"]
+    assert tips[0].url == "https://bucket.s3.amazonaws.com/0.png"
+    assert tips[0].added == datetime(2022, 1, 1)
+    assert tips[0].code_hash == hash_code("print(0)")
+    assert {tip.user_id for tip in tips} == {1}
+    # listed by sort=popular right away
+    with Session(target_engine) as session:
+        assert len(session.exec(select(TipStats)).all()) == 3
+
+    checkpoint = json.loads((tmp_path / "tips.ndjson.checkpoint").read_text())
+    assert checkpoint == {"line": 5}
+
+
+def test_import_resumes_from_checkpoint(target_engine, tmp_path):
+    lines = [
+        json.dumps({"title": f"tip {i}", "code": "x = 1", "username": "bob"})
+        for i in range(5)
+    ]
+    checkpoint = tmp_path / "checkpoint"
+    checkpoint.write_text(json.dumps({"line": 3}))
+
+    imported, skipped = import_tips(
+        target_engine, lines, batch_size=10, checkpoint=str(checkpoint)
+    )
+    assert (imported, skipped) == (2, [])
+    with Session(target_engine) as session:
+        titles = session.exec(select(Tip.title)).all()
+    assert titles == ["tip 3", "tip 4"]
+    assert json.loads(checkpoint.read_text()) == {"line": 5}
+
+
+def test_import_skips_titles_taken(target_engine, tmp_path):
+    lines = [
+        json.dumps({"title": title, "code": "x = 1", "username": "bob"})
+        for title in ("tip 0", "tip 1", "tip 1", "tip 2")
+    ]
+    import_tips(target_engine, lines[:1])
+    checkpoint = tmp_path / "checkpoint"
+
+    imported, skipped = import_tips(
+        target_engine, lines, batch_size=10, checkpoint=str(checkpoint)
+    )
+    assert imported == 2
+    assert skipped == [
+        (1, "bob already has a tip titled 'tip 0'"),
+        (3, "bob already has a tip titled 'tip 1'"),
+    ]
+    with Session(target_engine) as session:
+        titles = session.exec(select(Tip.title).order_by(Tip.id)).all()
+    assert titles == ["tip 0", "tip 1", "tip 2"]
+    assert json.loads(checkpoint.read_text()) == {"line": 4}
+
+
+def test_import_skips_concurrent_conflicts(target_engine):
+    lines = [
+        json.dumps({"title": "tip 0", "code": "x = 1", "username": "bob"}),
+        json.dumps({"title": "tip 1", "code": "z = 3", "username": "bob"}),
+    ]
+
+    def concurrent_insert(code):
+        if code == "z = 3":
+            # taken by another writer after the lookup of existing titles
+            with Session(target_engine) as session:
+                session.add(Tip(title="tip 1", code="y = 2", user_id=1))
+                session.commit()
+        return hash_code(code)
+
+    with patch("tips.bulk.hash_code", side_effect=concurrent_insert):
+        imported, skipped = import_tips(target_engine, lines)
+    assert imported == 1
+    assert skipped == [(2, "bob already has a tip titled 'tip 1'")]
+    with Session(target_engine) as session:
+        tips = session.exec(select(Tip.title, Tip.code).order_by(Tip.id)).all()
+    assert tips == [("tip 1", "y = 2"), ("tip 0", "x = 1")]
+
+
+@patch("tips.bulk.render_and_upload", return_value="https://new-bucket/x.png")
+def test_import_rerender(render_mock, target_engine):
+    lines = [
+        json.dumps(
+            {"title": "tip", "code": "x = 1", "username": "bob", "url": "https://old"}
+        )
+    ]
+    import_tips(target_engine, lines, urls="rerender")
+    with Session(target_engine) as session:
+        tip = session.exec(select(Tip)).one()
+    assert tip.url == "https://new-bucket/x.png"
+    assert render_mock.call_args.args[1] == "bob"
+
+
+@patch("tips.bulk.delete_from_s3")
+def test_import_rerender_deletes_images_of_conflicts(delete_mock, target_engine):
+    lines = [
+        json.dumps({"title": "tip 0", "code": "x = 1", "username": "bob"}),
+        json.dumps({"title": "tip 1", "code": "z = 3", "username": "bob"}),
+    ]
+
+    def render(tip, username):
+        if tip.code == "z = 3":
+            # taken by another writer while rendering
+            with Session(target_engine) as session:
+                session.add(Tip(title="tip 1", code="y = 2", user_id=1))
+                session.commit()
+        return s3_url(f"{tip.title}.png")
+
+    with patch("tips.bulk.render_and_upload", side_effect=render):
+        imported, skipped = import_tips(target_engine, lines, urls="rerender")
+    assert imported == 1
+    assert [line for line, _ in skipped] == [2]
+    delete_mock.assert_called_once_with(["tip 1.png"])
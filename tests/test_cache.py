@@ -0,0 +1,70 @@
+from unittest.mock import patch
+
+from tips.cache import LFUCache, TermStats, bump_generation
+
+
+def test_lfu_cache_evicts_least_frequently_used():
+    cache = LFUCache(maxsize=3, ttl=60)
+    for key in ("dataclass", "f-string", "lambda"):
+        cache.set(key, [key])
+    for _ in range(3):
+        cache.get("dataclass")
+    cache.get("f-string")
+
+    # lambda was used least
+    cache.set("walrus", ["walrus"])
+    assert cache.get("lambda") is None
+    assert cache.get("dataclass") == ["dataclass"]
+
+    # walrus and f-string tie on count now, the least recent one goes
+    cache.get("walrus")
+    cache.set("typing", ["typing"])
+    assert cache.get("f-string") is None
+    assert cache.get("walrus") == ["walrus"]
+    assert len(cache) == 3
+
+
+def test_lfu_cache_one_off_keys_dont_evict_popular_ones():
+    cache = LFUCache(maxsize=2, ttl=60)
+    cache.set("dataclass", [])
+    cache.get("dataclass")
+    for i in range(100):
+        cache.set(f"one-off {i}", [])
+    assert cache.get("dataclass") == []
+
+
+def test_lfu_cache_cleared_on_new_generation():
+    cache = LFUCache(maxsize=2, ttl=60)
+    cache.set("dataclass", ["tip"])
+    bump_generation()
+    assert cache.get("dataclass") is None
+    assert len(cache) == 0
+
+
+def test_lfu_cache_entries_expire():
+    cache = LFUCache(maxsize=2, ttl=60)
+    with patch("tips.cache.time.monotonic", return_value=1000):
+        cache.set("dataclass", ["tip"])
+        cache.set("lambda", ["tip"])
+        cache.get("lambda")
+    with patch("tips.cache.time.monotonic", return_value=1061):
+        assert cache.get("dataclass") is None
+        assert len(cache) == 1
+        # still evicts by use count after the removal
+        cache.set("walrus", ["tip"])
+        cache.set("typing", ["tip"])
+        assert cache.get("typing") == ["tip"]
+        assert len(cache) == 2
+
+
+def test_term_stats():
+    stats = TermStats(maxsize=4)
+    for term, hit in [("a", False), ("a", True), ("a", True), ("b", False)]:
+        stats.record(term, hit)
+    assert stats.top() == [("a", 2, 1), ("b", 0, 1)]
+
+    for term in ("c", "d", "e"):
+        stats.record(term, False)
+    # pruned to the 2 most searched terms once over maxsize
+    assert [term for term, *_ in stats.top()][0] == "a"
+    assert len(stats.top()) == 2
@@ -1,6 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+from unittest.mock import patch
+
 import pytest
 from sqlmodel import Session, create_engine, SQLModel, select
 
+from tips.db import verify_password
 from tips.models import User
 from tips.user import main
 
@@ -26,3 +31,68 @@ def test_cli(capfd, session: Session):
         main(args, engine=engine)
 
     assert capfd.readouterr().out.rstrip() == "peter already exists"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="bob", email="bob@pybit.es", password="hashed"))
+        session.commit()
+    return engine
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@patch("tips.user.send_activation_email")
+def test_cli_bulk_csv(send_mock, capfd, tmp_path, engine, executor):
+    cohort = tmp_path / "cohort.csv"
+    cohort.write_text(
+        "username,email,password\n"
+        "peter,peter@gmail.com,pass1\n"
+        "bob,bob@gmail.com,pass2\n"
+        "anna,bob@pybit.es,pass3\n"
+        "peter,peter2@gmail.com,pass4\n"
+        "sara,,pass5\n"
+        "mia,mia@gmail.com,pass6\n"
+    )
+    with pytest.raises(SystemExit):
+        main(["--bulk", str(cohort), "-b", "2"], engine=engine, executor=executor)
+
+    assert capfd.readouterr().out.splitlines() == [
+        "Created 2 of 6 users",
+        "Row 2 (bob): User already exists",
+        "Row 3 (anna): Email already in use",
+        "Row 4 (peter): User already exists",
+        "Row 5 (sara): missing email",
+    ]
+
+    with Session(engine) as session:
+        users = session.exec(select(User).order_by(User.id)).all()
+    assert [user.username for user in users] == ["bob", "peter", "mia"]
+    peter = users[1]
+    assert verify_password("pass1", peter.password)
+    assert peter.activation_key
+    assert peter.verified is False
+    assert peter.added is not None
+
+    assert sorted(call.args for call in send_mock.call_args_list) == sorted(
+        (user.email, user.activation_key) for user in users[1:]
+    )
+
+
+@patch("tips.user.send_activation_email")
+def test_cli_bulk_json_no_email(send_mock, capfd, tmp_path, engine, executor):
+    cohort = tmp_path / "cohort.json"
+    cohort.write_text(
+        json.dumps([{"username": "peter", "email": "peter@gmail.com", "password": "x"}])
+    )
+    main(["--bulk", str(cohort), "--no-email"], engine=engine, executor=executor)
+
+    assert capfd.readouterr().out.rstrip() == "Created 1 of 1 users"
+    send_mock.assert_not_called()
@@ -0,0 +1,134 @@
+import gzip
+
+import brotli
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from tips.cache import TTLCache, bump_generation, generation, listing_cache
+from tips.compression import CompressionMiddleware
+from tips.models import Tip, User
+
+BODY = "print('hello world')\n" * 100
+
+
+@pytest.fixture
+def tips(session: Session):
+    user = User(username="bob", email="bob@pybit.es", password="hashed")
+    for i in range(5):
+        tip = Tip(title=f"tip {i}", code=BODY, description="some description")
+        tip.user = user
+        session.add(tip)
+    session.commit()
+
+
+@pytest.fixture
+def small_app():
+    app = FastAPI()
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=100,
+        route_levels={"/fast": 1},
+        cached_paths={"/cached"},
+        cache=TTLCache(maxsize=10, ttl=60),
+    )
+
+    calls = []
+
+    @app.get("/small", response_class=PlainTextResponse)
+    def small():
+        return "tiny"
+
+    @app.get("/fast", response_class=PlainTextResponse)
+    def fast():
+        return BODY
+
+    @app.get("/cached", response_class=PlainTextResponse)
+    def cached():
+        calls.append(1)
+        return BODY
+
+    app.state.calls = calls
+    return app
+
+
+@pytest.mark.parametrize(
+    "encoding, decompress", [("br", brotli.decompress), ("gzip", gzip.decompress)]
+)
+def test_listing_compressed(tips, client: TestClient, encoding, decompress):
+    headers = {"Accept-Encoding": encoding}
+    with client.stream("GET", "/tips", headers=headers) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) == len(raw)
+
+    body = decompress(raw)
+    assert len(raw) < len(body)
+    assert body == client.get("/tips", headers={"Accept-Encoding": "identity"}).content
+
+
+def test_listing_not_compressed_without_accept_encoding(tips, client: TestClient):
+    response = client.get("/tips", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert len(response.json()) == 5
+
+
+def test_listing_cache_stores_compressed_body(tips, client: TestClient):
+    headers = {"Accept-Encoding": "br"}
+    client.get("/tips", headers=headers)
+    assert len(listing_cache) == 1
+    cached = listing_cache.get(("/tips", b"", "testserver", "br", generation()))
+    assert cached is not None
+    status, raw_headers, body = cached
+    assert status == 200
+    assert (b"content-encoding", b"br") in raw_headers
+    assert len(brotli.decompress(body)) > len(body)
+
+
+def test_listing_cache_keyed_on_host(tips, client: TestClient):
+    first = client.get("/tips", headers={"Host": "codeimag.es"})
+    second = client.get("/tips", headers={"Host": "www.codeimag.es"})
+    assert len(listing_cache) == 2
+    assert first.json() == second.json()
+
+
+def test_listing_cache_invalidated_by_generation(
+    tips, session: Session, client: TestClient
+):
+    assert len(client.get("/tips").json()) == 5
+
+    session.add(Tip(title="new one", code="x = 1"))
+    session.commit()
+    assert len(client.get("/tips").json()) == 5
+
+    bump_generation()
+    assert len(client.get("/tips").json()) == 6
+
+
+def test_minimum_size(small_app):
+    client = TestClient(small_app)
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "tiny"
+
+
+def test_route_level(small_app):
+    client = TestClient(small_app)
+    with client.stream("GET", "/fast", headers={"Accept-Encoding": "gzip"}) as r:
+        raw = b"".join(r.iter_raw())
+    assert raw == gzip.compress(BODY.encode(), compresslevel=1)
+
+
+def test_cached_path_skips_endpoint(small_app):
+    client = TestClient(small_app)
+    for _ in range(3):
+        response = client.get("/cached", headers={"Accept-Encoding": "br"})
+        assert response.text == BODY
+    assert len(small_app.state.calls) == 1
+
+    client.get("/cached", headers={"Accept-Encoding": "gzip"})
+    assert len(small_app.state.calls) == 2
@@ -0,0 +1,47 @@
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from tips.db import hash_code, normalize_code
+from tips.dedup import main
+from tips.models import Tip, User
+
+
+def test_normalize_code():
+    code = "\r\n    def f():\r\n        return 1   \r\n\r\n"
+    assert normalize_code(code) == "def f():\n    return 1"
+    assert hash_code(code) == hash_code("def f():\n    return 1\n")
+    assert hash_code(code) != hash_code("def f():\n    return 2")
+
+
+def test_dedup_cli(capfd):
+    engine = create_engine("sqlite:///")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(username="bob", email="bob@pybit.es", password="hashed")
+        for title, code in [
+            ("first", "print('hello')"),
+            ("second", "print('hello')  \n"),
+            ("third", "x = 1"),
+        ]:
+            session.add(Tip(title=title, code=code, user=user))
+        session.commit()
+
+    main(["--batch-size", "2"], engine=engine)
+
+    with Session(engine) as session:
+        tips = session.exec(select(Tip).order_by(Tip.id)).all()
+    assert [tip.code_hash for tip in tips] == [
+        hash_code("print('hello')"),
+        hash_code("print('hello')"),
+        hash_code("x = 1"),
+    ]
+
+    output = capfd.readouterr().out
+    assert "Backfilled 3 code hashes" in output
+    assert "(2 copies)" in output
+    assert "#1 'first' by bob" in output
+    assert "#2 'second' by bob" in output
+    assert "1 duplicate clusters" in output
+
+    # nothing left to backfill
+    main([], engine=engine)
+    assert "Backfilled 0 code hashes" in capfd.readouterr().out
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.pool import QueuePool
+from sqlmodel import Session, create_engine
+
+from tips.health import Health, health
+
+
+@pytest.fixture(autouse=True)
+def reset_health():
+    health.reset()
+    yield
+    health.reset()
+
+
+def test_check_reuses_result_within_ttl():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) > 1:
+            raise ConnectionError("bucket gone")
+
+    checks = Health()
+    assert checks.check("storage", flaky, ttl=60)["ok"] is True
+    assert checks.check("storage", flaky, ttl=60)["ok"] is True
+    assert len(calls) == 1
+
+    result = checks.check("storage", flaky)
+    assert result["ok"] is False
+    assert result["error"] == "ConnectionError: bucket gone"
+    assert result["latency_ms"] >= 0
+
+
+@patch("tips.health.warm_up_renderer")
+@patch("tips.health.check_bucket")
+@patch("tips.health.check_renderer")
+def test_warm_up(renderer_mock, bucket_mock, render_mock, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}", poolclass=QueuePool)
+    checks = Health()
+    checks.warm_up(engine, render=True)
+
+    assert checks.warmed_up
+    # WARMUP_DB_CONNECTIONS connections ready in the pool
+    assert engine.pool.checkedin() == 2
+    assert renderer_mock.called and bucket_mock.called and render_mock.called
+    assert set(checks.results) == {"db", "renderer", "storage", "warm_up_render"}
+
+
+@patch("tips.health.check_bucket", side_effect=ConnectionError("no network"))
+@patch("tips.health.check_renderer")
+def test_healthz_and_readyz(
+    renderer_mock, bucket_mock, session: Session, client: TestClient
+):
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok", "warmed_up": False, "checks": {}}
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["warmed_up"] is False
+
+    health.warm_up(session.get_bind(), render=False)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    checks = response.json()["checks"]
+    assert checks["db"]["ok"] and checks["renderer"]["ok"]
+    assert checks["storage"]["error"] == "ConnectionError: no network"
+
+    bucket_mock.side_effect = None
+    # storage is only checked again once the result is stale
+    assert client.get("/readyz").status_code == 503
+    with patch("tips.health.HEALTH_CHECK_TTL", 0):
+        response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+    assert client.get("/healthz").json()["checks"]["storage"]["ok"] is True
@@ -0,0 +1,52 @@
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+
+def sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+def test_metrics_endpoint(client: TestClient):
+    client.get("/tips")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    for metric in (
+        "codeimages_http_requests_total",
+        "codeimages_http_request_duration_seconds_bucket",
+        "codeimages_http_requests_in_progress",
+        "codeimages_create_tip_stage_seconds",
+        "codeimages_renders_total",
+        "codeimages_s3_upload_bytes_total",
+        "codeimages_db_pool_checked_out",
+        "codeimages_cache_lookups_total",
+    ):
+        assert metric in body
+
+
+def test_requests_counted_per_route(client: TestClient):
+    labels = {"method": "GET", "route": "/tips", "status": "200"}
+    before = sample("codeimages_http_requests_total", labels)
+    client.get("/tips", params={"offset": 0})
+    client.get("/tips", params={"offset": 0})
+    assert sample("codeimages_http_requests_total", labels) == before + 2
+
+
+def test_unknown_paths_share_a_label(client: TestClient):
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample("codeimages_http_requests_total", labels)
+    client.get("/does/not/exist")
+    client.get("/nor/does/this")
+    assert sample("codeimages_http_requests_total", labels) == before + 2
+
+
+def test_listing_cache_hits_counted(client: TestClient):
+    hits = {"cache": "listing", "result": "hit"}
+    misses = {"cache": "listing", "result": "miss"}
+    hits_before = sample("codeimages_cache_lookups_total", hits)
+    misses_before = sample("codeimages_cache_lookups_total", misses)
+    for _ in range(3):
+        client.get("/tips", params={"limit": 7})
+    assert sample("codeimages_cache_lookups_total", misses) == misses_before + 1
+    assert sample("codeimages_cache_lookups_total", hits) == hits_before + 2
@@ -0,0 +1,122 @@
+from datetime import datetime, timezone
+import time
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from tips.aws import DeleteQueue, s3_key, s3_url
+from tips.db import image_keys_in_use
+from tips.models import Tip
+from tips.orphans import find_orphans, main
+
+OLD = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+def _objects(*keys, modified=OLD):
+    return [{"Key": key, "LastModified": modified, "Size": 1000} for key in keys]
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for i, key in enumerate(["b.png", "d.png", "d.png", "f.png"]):
+            session.add(Tip(title=f"tip {i}", code=f"{i}", url=s3_url(key)))
+        # no image in our bucket
+        session.add(Tip(title="imported", code="x", url="https://other/a.png"))
+        session.add(Tip(title="no image", code="y"))
+        session.commit()
+    return engine
+
+
+def test_s3_key():
+    assert s3_key(s3_url("abc.png")) == "abc.png"
+    assert s3_key("https://elsewhere.s3.amazonaws.com/abc.png") is None
+
+
+def test_find_orphans():
+    objects = _objects("a.png", "b.png", "c.png", "d.png", "e.png", "f.png")
+    keys = ["b.png", "d.png", "d.png", "f.png", "g.png"]
+    orphans = find_orphans(iter(objects), iter(keys))
+    assert [obj["Key"] for obj in orphans] == ["a.png", "c.png", "e.png"]
+    assert list(find_orphans(iter(objects), iter([]))) == objects
+
+
+def test_sweep(engine, capfd):
+    objects = _objects("a.png", "b.png", "c.png", "d.png", "e.png", "f.png")
+    # still rendering, its tip isn't committed yet
+    objects += _objects("g.png", modified=datetime.now(timezone.utc))
+    deleted = []
+
+    def delete(keys):
+        deleted.append(keys)
+        return ["e.png"] if "e.png" in keys else []
+
+    main(["--dry-run"], engine=engine, list_objects=lambda: objects, delete=delete)
+    assert deleted == []
+    output = capfd.readouterr().out
+    assert output.splitlines() == [
+        "a.png",
+        "c.png",
+        "e.png",
+        "Would delete 3 orphaned images (0.0 MB)",
+    ]
+
+    main(
+        ["--batch-size", "2"],
+        engine=engine,
+        list_objects=lambda: objects,
+        delete=delete,
+    )
+    assert deleted == [["a.png", "c.png"], ["e.png"]]
+    output = capfd.readouterr().out
+    assert "Deleted 2 orphaned images" in output
+    assert "Failed to delete e.png" in output
+
+
+def test_delete_queue_batches():
+    deleted = []
+    queue = DeleteQueue(interval=60, delete=lambda keys: deleted.append(keys) or [])
+    for i in range(3):
+        queue.put(f"{i}.png")
+    queue.flush()
+    queue.flush()
+    assert deleted == [["0.png", "1.png", "2.png"]]
+
+
+def test_delete_queue_flushes_full_batch():
+    deleted = []
+    queue = DeleteQueue(interval=60, delete=lambda keys: deleted.append(keys) or [])
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("tips.aws.MAX_DELETE_BATCH", 2)
+        queue.put("a.png")
+        queue.put("b.png")
+        # flushed by the background thread right away, not after a minute
+        for _ in range(100):
+            if deleted:
+                break
+            time.sleep(0.01)
+    assert deleted == [["a.png", "b.png"]]
+
+
+def test_delete_queue_keeps_images_in_use_again():
+    deleted = []
+    queue = DeleteQueue(
+        interval=60,
+        delete=lambda keys: deleted.append(keys) or [],
+        in_use=lambda images: {"reposted.png"},
+    )
+    queue.put("deleted.png", "abc")
+    queue.put("reposted.png", "def")
+    queue.flush()
+    assert deleted == [["deleted.png"]]
+
+
+def test_image_keys_in_use(engine):
+    with Session(engine) as session:
+        session.add(Tip(title="linked", code="x", code_hash="abc", url=s3_url("a.png")))
+        session.commit()
+    images = [("a.png", "abc"), ("b.png", "abc"), ("c.png", None)]
+    assert image_keys_in_use(engine, images) == {"a.png"}
+    assert image_keys_in_use(engine, [("a.png", None)]) == set()
@@ -0,0 +1,177 @@
+import base64
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from tips.post_snippet import (
+    CREATE_TIP_URL,
+    get_cached_token,
+    load_snippets,
+    post_snippets,
+    run_batch,
+)
+
+
+def _jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode())
+    return f"header.{payload.decode().rstrip('=')}.signature"
+
+
+@pytest.fixture
+def snippets_dir(tmp_path):
+    (tmp_path / "hello.py").write_text("print('hello')\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "query.sql").write_text("select 1;\n")
+    (tmp_path / ".hidden.py").write_text("secret = 1\n")
+    return tmp_path
+
+
+def test_load_snippets_from_directory(snippets_dir):
+    snippets = load_snippets(str(snippets_dir))
+    assert [(s["title"], s["language"]) for s in snippets] == [
+        ("hello", "python"),
+        ("query", "sql"),
+    ]
+    assert snippets[0]["code"] == "print('hello')\n"
+
+
+def test_load_snippets_from_glob(snippets_dir):
+    snippets = load_snippets(f"{snippets_dir}/**/*.sql")
+    assert [s["source"] for s in snippets] == [str(snippets_dir / "sub" / "query.sql")]
+
+
+def test_load_snippets_from_manifest(snippets_dir):
+    manifest = snippets_dir / "manifest.yaml"
+    manifest.write_text(
+        "- file: hello.py\n"
+        "  title: Hello world\n"
+        "  theme: monokai\n"
+        "- code: echo hi\n"
+        "  title: Shell\n"
+        "  language: application/x-sh\n"
+    )
+    first, second = load_snippets(str(manifest))
+    assert first["title"] == "Hello world"
+    assert first["language"] == "python"
+    assert first["theme"] == "monokai"
+    assert second["code"] == "echo hi"
+    assert second["source"] == f"{manifest}[1]"
+
+
+def test_manifest_entry_without_file_or_code(snippets_dir):
+    manifest = snippets_dir / "manifest.json"
+    manifest.write_text(json.dumps([{"file": "hello.py"}, {"title": "empty"}]))
+    with pytest.raises(ValueError, match=r"manifest.json\[1\]: entry has neither"):
+        load_snippets(str(manifest))
+
+
+def test_cached_token_reused_until_expiry(tmp_path):
+    cache = tmp_path / "token.json"
+    token = _jwt(time.time() + 3600)
+    session = MagicMock()
+    session.post.return_value.json.return_value = {"access_token": token}
+
+    assert get_cached_token("bob", "pw", session, cache) == token
+    assert get_cached_token("bob", "pw", session, cache) == token
+    assert session.post.call_count == 1
+    assert cache.stat().st_mode & 0o777 == 0o600
+
+    # another user or an (almost) expired token needs a new one
+    get_cached_token("julian", "pw", session, cache)
+    assert session.post.call_count == 2
+    cache.write_text(json.dumps({"user": "julian", "access_token": "x", "exp": 0}))
+    get_cached_token("julian", "pw", session, cache)
+    assert session.post.call_count == 3
+
+
+def test_cached_token_per_site_and_refresh(tmp_path):
+    cache = tmp_path / "token.json"
+    session = MagicMock()
+    session.post.return_value.json.return_value = {
+        "access_token": _jwt(time.time() + 3600)
+    }
+
+    get_cached_token("bob", "pw", session, cache)
+    with patch("tips.post_snippet.BASE_URL", "https://codeimag.es"):
+        get_cached_token("bob", "pw", session, cache)
+    assert session.post.call_count == 2
+    get_cached_token("bob", "pw", session, cache, refresh=True)
+    assert session.post.call_count == 3
+
+
+def test_run_batch_refreshes_rejected_token(snippets_dir, tmp_path):
+    old, new = _jwt(time.time() + 3600), _jwt(time.time() + 7200)
+    cache = tmp_path / "token.json"
+    cache.write_text(
+        json.dumps(
+            {
+                "base_url": "http://localhost:8000",
+                "user": "bob",
+                "access_token": old,
+                "exp": time.time() + 3600,
+            }
+        )
+    )
+
+    def post(url, data=None, json=None, headers=None):
+        if data is not None:
+            return MagicMock(json=MagicMock(return_value={"access_token": new}))
+        ok = headers["Authorization"] == f"Bearer {new}"
+        response = MagicMock(ok=ok, status_code=200 if ok else 401)
+        response.json.return_value = {"url": "u"} if ok else {"detail": "expired"}
+        return response
+
+    session = MagicMock()
+    session.__enter__.return_value.post.side_effect = post
+    summary = tmp_path / "summary.json"
+    with patch("tips.post_snippet._http_session", return_value=session), patch(
+        "tips.post_snippet.BASE_URL", "http://localhost:8000"
+    ):
+        assert run_batch(
+            "bob",
+            "pw",
+            f"{snippets_dir}/*.py",
+            parallel=2,
+            summary=summary,
+            cache=cache,
+        )
+    results = json.loads(summary.read_text())
+    assert [result["status"] for result in results] == [200]
+    assert json.loads(cache.read_text())["access_token"] == new
+
+
+def test_post_snippets():
+    ok, bad = MagicMock(ok=True, status_code=200), MagicMock(ok=False, status_code=400)
+    ok.json.return_value = {"url": "https://bucket/hello.png"}
+    bad.json.return_value = {"detail": "Cannot add same tip twice"}
+    session = MagicMock()
+    session.post.side_effect = lambda url, json, headers: (
+        ok if json["title"] == "hello" else bad
+    )
+    snippets = [
+        {"source": "hello.py", "title": "hello", "code": "x = 1", "language": "python"},
+        {"source": "again.py", "title": "again", "code": "x = 1", "language": "python"},
+    ]
+
+    results = post_snippets(session, "token", snippets, parallel=2)
+
+    assert results == [
+        {
+            "source": "hello.py",
+            "title": "hello",
+            "status": 200,
+            "url": "https://bucket/hello.png",
+        },
+        {
+            "source": "again.py",
+            "title": "again",
+            "status": 400,
+            "error": "Cannot add same tip twice",
+        },
+    ]
+    (url,) = {call.args[0] for call in session.post.call_args_list}
+    assert url == CREATE_TIP_URL
+    payload = session.post.call_args_list[0].kwargs["json"]
+    assert "source" not in payload
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from tips.render import (
+    FAST_LANE,
+    SLOW_LANE,
+    image_filename,
+    render_and_upload,
+    render_cost,
+    render_lane,
+    scratch_dir,
+    sweep_scratch_dirs,
+)
+
+
+@pytest.fixture(autouse=True)
+def scratch_root(tmp_path):
+    with patch("tips.render.SCRATCH_DIR", str(tmp_path)):
+        yield tmp_path
+
+
+def test_scratch_dir_removed_on_failure(scratch_root):
+    with pytest.raises(RuntimeError):
+        with scratch_dir() as workdir:
+            open(os.path.join(workdir, "carbon.png"), "w").close()
+            raise RuntimeError("chrome crashed")
+    assert not os.path.exists(workdir)
+    assert os.listdir(scratch_root) == []
+
+
+def test_concurrent_renders_same_user_dont_clash(scratch_root):
+    def fake_carbon(code, destination, **options):
+        time.sleep(0.05)
+        with open(os.path.join(destination, "carbon.png"), "w") as f:
+            f.write(code)
+
+    def fake_upload(filename):
+        with open(filename) as f:
+            return f.read()
+
+    tip = SimpleNamespace(
+        title="same title", language="python", background="", theme="", wt=""
+    )
+    codes = [f"print({i})" for i in range(8)]
+    with patch("tips.render.create_code_image", fake_carbon), patch(
+        "tips.render.upload_to_s3", fake_upload
+    ), ThreadPoolExecutor(max_workers=8) as executor:
+        urls = list(
+            executor.map(
+                lambda code: render_and_upload(
+                    SimpleNamespace(**vars(tip), code=code), "bob"
+                ),
+                codes,
+            )
+        )
+    assert urls == codes
+    assert os.listdir(scratch_root) == []
+
+
+def test_image_filename_unique_per_upload():
+    first, second = image_filename("bob", "hello"), image_filename("bob", "hello")
+    assert first != second
+    assert first.startswith("Ym9iX2hlbGxv-") and first.endswith(".png")
+
+
+def test_sweep_scratch_dirs(scratch_root):
+    stale = scratch_root / "codeimages-stale"
+    stale.mkdir()
+    (stale / "carbon.png").touch()
+    hour_ago = time.time() - 3600
+    os.utime(stale, (hour_ago, hour_ago))
+    fresh = scratch_root / "codeimages-fresh"
+    fresh.mkdir()
+    unrelated = scratch_root / "other-app"
+    unrelated.mkdir()
+    os.utime(unrelated, (hour_ago, hour_ago))
+
+    assert sweep_scratch_dirs(max_age=600) == 1
+    assert sorted(os.listdir(scratch_root)) == ["codeimages-fresh", "other-app"]
+
+
+def test_sweep_scratch_dirs_creates_missing_dir(scratch_root):
+    missing = scratch_root / "scratch"
+    with patch("tips.render.SCRATCH_DIR", str(missing)):
+        assert sweep_scratch_dirs() == 0
+        with scratch_dir() as workdir:
+            assert os.path.dirname(workdir) == str(missing)
+
+
+def test_render_lane_by_cost():
+    assert render_cost("print()") < 2
+    assert render_cost("x = 1\n" * 40) == 40 + 240 / 2000
+    # same number of lines, twice as wide
+    assert render_cost(("x" * 160 + "\n") * 40) > 80
+    assert render_lane("print()\n" * 10) is FAST_LANE
+    assert render_lane("print()\n" * 100) is SLOW_LANE
+    assert render_lane(("x" * 200 + "\n") * 30) is SLOW_LANE
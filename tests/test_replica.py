@@ -0,0 +1,92 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from tips.db import ReplicaRouter, replica_connect_args
+from tips.main import app, get_read_session
+from tips.models import Tip
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+
+
+@pytest.fixture
+def replica(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def test_replica_connect_timeout():
+    url = "postgresql://user:pw@replica:5432/tips"
+    assert replica_connect_args(url, timeout=2) == {"connect_timeout": 2}
+    assert replica_connect_args("sqlite:///replica.db") == {}
+
+
+def test_router_without_replica(primary):
+    router = ReplicaRouter(primary, None, max_lag=10, interval=0)
+    assert router.engine() is primary
+
+
+def test_router_falls_back_when_lagging(primary, replica):
+    router = ReplicaRouter(primary, replica, max_lag=10, interval=0)
+    assert router.engine() is replica
+    with patch.object(router, "replica_lag", return_value=11):
+        assert router.engine() is primary
+    assert router.engine() is replica
+
+
+def test_router_falls_back_when_down(primary, tmp_path):
+    down = create_engine(f"sqlite:///{tmp_path / 'no such dir' / 'replica.db'}")
+    router = ReplicaRouter(primary, down, max_lag=10, interval=0)
+    assert router.engine() is primary
+
+
+def test_router_checks_once_per_interval(primary, replica):
+    router = ReplicaRouter(primary, replica, max_lag=10, interval=60)
+    with patch.object(router, "replica_lag", return_value=0) as lag_mock:
+        for _ in range(3):
+            assert router.engine() is replica
+    assert lag_mock.call_count == 1
+
+
+def test_router_reads_from_primary_right_after_a_write(primary, replica):
+    router = ReplicaRouter(primary, replica, max_lag=10, interval=60)
+    with patch("tips.db.time.monotonic", return_value=1000):
+        assert router.engine() is replica
+        router.note_write()
+        # the replica may not have it yet, don't cache what it returns
+        assert router.engine() is primary
+    with patch("tips.db.time.monotonic", return_value=1010):
+        assert router.engine() is replica
+
+
+def test_reads_routed_to_replica(replica, session: Session, client: TestClient):
+    with Session(replica) as replica_session:
+        replica_session.add(Tip(title="from the replica", code="1"))
+        replica_session.commit()
+
+    def get_replica_session():
+        with Session(replica, expire_on_commit=False) as replica_session:
+            yield replica_session
+
+    app.dependency_overrides[get_read_session] = get_replica_session
+    response = client.get("/tips")
+    assert [tip["title"] for tip in response.json()] == ["from the replica"]
+    assert "from the replica" in client.post("/search", data={"term": "rep"}).text
+    # writes and the logins that follow them stay on the primary
+    response = client.post(
+        "/users",
+        json={
+            "username": "bob",
+            "email": "bob@pybit.es",
+            "password": "a",
+            "password2": "a",
+        },
+    )
+    assert response.status_code == 201
+    assert client.get("/users/bob/tips").status_code == 404
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from tips.models import Tip, User
+from tips.rerender import default_checkpoint, main, rerender
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        bob = User(username="bob", email="bob@pybit.es", password="hashed")
+        julian = User(username="julian", email="julian@pybit.es", password="hashed")
+        for i in range(6):
+            session.add(
+                Tip(
+                    title=f"tip {i}",
+                    code=f"print({i})",
+                    language="python" if i < 4 else "bash",
+                    theme="seti" if i % 2 == 0 else "monokai",
+                    url=f"https://old/{i}.png",
+                    added=datetime(2022, 1, i + 1),
+                    user=bob if i < 3 else julian,
+                )
+            )
+        session.commit()
+    return engine
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def _fake_render(tip, username):
+    if tip.title == "tip 2":
+        raise RuntimeError("chrome crashed")
+    return f"https://new/{username}/{tip.id}.png"
+
+
+def _urls(engine):
+    with Session(engine) as session:
+        return dict(session.exec(select(Tip.id, Tip.url)).all())
+
+
+@patch("tips.rerender.render_and_upload", side_effect=_fake_render)
+def test_rerender_reports_throughput_and_failures(
+    render_mock, engine, executor, tmp_path, capfd
+):
+    checkpoint = tmp_path / "checkpoint"
+    main(
+        ["--batch-size", "2", "--checkpoint", str(checkpoint)],
+        engine=engine,
+        executor=executor,
+    )
+    output = capfd.readouterr().out
+    assert "Rendered 5 tips in" in output
+    assert "1 failures" in output
+    assert "  #3 'tip 2': RuntimeError('chrome crashed')" in output
+    assert json.loads(checkpoint.read_text()) == {
+        "filters": {},
+        "last_id": 6,
+        "failed": [3],
+    }
+
+    urls = _urls(engine)
+    assert urls[1] == "https://new/bob/1.png"
+    assert urls[3] == "https://old/2.png"
+    assert urls[6] == "https://new/julian/6.png"
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (["--theme", "seti"], {1, 5}),
+        (["--language", "Bash"], {5, 6}),
+        (["--since", "2022-01-02", "--until", "2022-01-04"], {2}),
+        (["--user", "julian", "--theme", "monokai"], {4, 6}),
+    ],
+)
+@patch("tips.rerender.render_and_upload", side_effect=_fake_render)
+def test_rerender_filters(render_mock, engine, executor, tmp_path, args, expected):
+    main(
+        args + ["--checkpoint", str(tmp_path / "checkpoint")],
+        engine=engine,
+        executor=executor,
+    )
+    rerendered = {tip_id for tip_id, url in _urls(engine).items() if "new" in url}
+    assert rerendered == expected
+
+
+@patch("tips.rerender.render_and_upload", side_effect=_fake_render)
+def test_rerender_resumes_from_checkpoint(render_mock, engine, executor, tmp_path):
+    checkpoint = tmp_path / "checkpoint"
+    checkpoint.write_text(json.dumps({"last_id": 4}))
+
+    rendered, failures = rerender(
+        engine, executor, batch_size=10, checkpoint=str(checkpoint)
+    )
+    assert (rendered, failures) == (2, [])
+    assert json.loads(checkpoint.read_text()) == {
+        "filters": {},
+        "last_id": 6,
+        "failed": [],
+    }
+    rerendered = {tip_id for tip_id, url in _urls(engine).items() if "new" in url}
+    assert rerendered == {5, 6}
+
+
+def test_rerender_retries_failures_on_resume(engine, executor, tmp_path, capfd):
+    checkpoint = tmp_path / "checkpoint"
+    args = ["--batch-size", "2", "--checkpoint", str(checkpoint)]
+    with patch("tips.rerender.render_and_upload", side_effect=_fake_render):
+        main(args, engine=engine, executor=executor)
+    capfd.readouterr()
+
+    with patch("tips.rerender.render_and_upload", return_value="https://new/3.png"):
+        main(args, engine=engine, executor=executor)
+    output = capfd.readouterr().out
+    assert "Rendered 1 tips in" in output
+    assert "0 failures" in output
+    assert _urls(engine)[3] == "https://new/3.png"
+    assert not checkpoint.exists()
+
+
+@patch("tips.rerender.render_and_upload", side_effect=_fake_render)
+def test_rerender_refuses_checkpoint_of_other_filters(
+    render_mock, engine, executor, tmp_path
+):
+    checkpoint = tmp_path / "checkpoint"
+    checkpoint.write_text(
+        json.dumps({"filters": {"theme": "seti"}, "last_id": 4, "failed": []})
+    )
+    with pytest.raises(SystemExit):
+        main(
+            ["--theme", "monokai", "--checkpoint", str(checkpoint)],
+            engine=engine,
+            executor=executor,
+        )
+    render_mock.assert_not_called()
+
+
+def test_default_checkpoint_per_filters():
+    seti = default_checkpoint(dict(theme="seti", language=None))
+    assert seti == default_checkpoint(dict(language=None, theme="seti"))
+    assert seti != default_checkpoint(dict(theme="monokai", language=None))
+    assert seti != default_checkpoint(dict(theme="seti", since=datetime(2022, 1, 1)))
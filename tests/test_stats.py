@@ -0,0 +1,71 @@
+import pytest
+from sqlmodel import Session, select
+
+from tips.models import Tip, TipStats
+from tips.stats import StatsBuffer
+
+
+@pytest.fixture
+def tips(session: Session):
+    tips = [Tip(title=f"tip {i}", code=f"{i}") for i in range(3)]
+    session.add_all(tips)
+    session.commit()
+    return tips
+
+
+def _stats(session):
+    session.expire_all()
+    return {
+        stats.tip_id: (stats.views, stats.copies, stats.downloads, stats.score)
+        for stats in session.exec(select(TipStats))
+    }
+
+
+def test_flush_adds_deltas(session: Session, tips):
+    buffer = StatsBuffer(interval=60, max_tips=100)
+    first, second, _ = tips
+    for event in ("views", "views", "copies"):
+        buffer.record(first.id, event)
+    buffer.record(second.id, "downloads")
+    # deleted in the meantime
+    buffer.record(12345, "views")
+
+    assert buffer.flush(session.get_bind()) == 2
+    assert _stats(session) == {first.id: (2, 1, 0, 12), second.id: (0, 0, 1, 10)}
+    assert buffer.flush(session.get_bind()) == 0
+
+    buffer.record(first.id, "views")
+    buffer.flush(session.get_bind())
+    assert _stats(session)[first.id] == (3, 1, 0, 13)
+
+
+def test_buffer_bounded(tips):
+    buffer = StatsBuffer(interval=60, max_tips=2)
+    assert buffer.record(1, "views")
+    assert buffer.record(2, "views")
+    assert not buffer.record(3, "views")
+    # known tips are still counted
+    assert buffer.record(1, "copies")
+
+
+def test_repeats_of_a_client_ignored():
+    buffer = StatsBuffer(dedupe_window=60)
+    assert buffer.record(1, "views", client="1.2.3.4")
+    assert not buffer.record(1, "views", client="1.2.3.4")
+    assert buffer.record(1, "copies", client="1.2.3.4")
+    assert buffer.record(2, "views", client="1.2.3.4")
+    assert buffer.record(1, "views", client="5.6.7.8")
+
+
+def test_failed_flush_keeps_counts(session: Session, tips):
+    class Down:
+        def begin(self):
+            raise ConnectionError("db down")
+
+    buffer = StatsBuffer(interval=60, max_tips=100)
+    buffer.record(tips[0].id, "views")
+    with pytest.raises(ConnectionError):
+        buffer.flush(Down())
+    buffer.record(tips[0].id, "views")
+    buffer.flush(session.get_bind())
+    assert _stats(session) == {tips[0].id: (2, 0, 0, 2)}
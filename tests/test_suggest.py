@@ -0,0 +1,77 @@
+import threading
+from unittest.mock import patch
+
+from sqlmodel import Session
+
+from tips.models import Tip, User
+from tips.suggest import SuggestIndex
+
+
+def test_suggest_index(session: Session):
+    user = User(username="Bob", email="bob@pybit.es", password="x")
+    session.add(Tip(title="python tricks", code="1", language="python", user=user))
+    session.add(Tip(title="Pytest fixtures", code="2", language="python", user=user))
+    session.add(Tip(title="list files", code="3", language="bash", user=user))
+    session.commit()
+
+    bind = session.get_bind()
+    index = SuggestIndex(max_age=300)
+    assert index.suggest(bind, "PY") == [
+        ("title", "Pytest fixtures"),
+        ("language", "python"),
+        ("title", "python tricks"),
+    ]
+    assert index.suggest(bind, "py", limit=1) == [("title", "Pytest fixtures")]
+    assert index.suggest(bind, "b") == [("language", "bash"), ("user", "Bob")]
+    assert index.suggest(bind, "  ") == []
+
+    index.add("bash aliases", "bob", "bash")
+    assert index.suggest(bind, "b") == [
+        ("language", "bash"),
+        ("title", "bash aliases"),
+        ("user", "Bob"),
+        ("user", "bob"),
+    ]
+    # bash is still used by "list files"
+    index.remove("bash aliases", "bob", "bash")
+    assert index.suggest(bind, "b") == [("language", "bash"), ("user", "Bob")]
+    index.remove("list files", "Bob", "bash")
+    assert index.suggest(bind, "b") == [("user", "Bob")]
+
+
+def test_suggest_index_rebuilds_when_stale(session: Session):
+    bind = session.get_bind()
+    index = SuggestIndex(max_age=0)
+    assert index.suggest(bind, "hello") == []
+    # e.g. written by another worker
+    session.add(Tip(title="hello world", code="print('hello world')"))
+    session.commit()
+
+    # rebuilt in the background, the lookup doesn't wait for it
+    with patch.object(index, "start_build") as start_mock:
+        assert index.suggest(bind, "hello") == []
+    start_mock.assert_called_once_with(bind)
+
+    thread = index.start_build(bind)
+    # one build at a time
+    assert index.start_build(bind) is None
+    thread.join()
+    index.max_age = 300
+    assert index.suggest(bind, "hello") == [("title", "hello world")]
+
+
+def test_suggest_index_not_built_yet(session: Session):
+    bind = session.get_bind()
+    session.add(Tip(title="hello world", code="print('hello world')"))
+    session.commit()
+    index = SuggestIndex(max_age=300)
+
+    # the startup build is still running, or fails
+    done = threading.Event()
+    with patch.object(index, "build", side_effect=lambda bind: done.wait()):
+        thread = index.start_build(bind)
+        assert index.suggest(bind, "hello") == []
+        done.set()
+        thread.join()
+    # the next lookup builds it
+    assert index.suggest(bind, "hello") == [("title", "hello world")]
@@ -0,0 +1,175 @@
+"""
+Fingerprinted, precompressed static assets
+
+Build step (run at slug compile time, see bin/post_compile):
+
+    python -m tips.assets
+
+copies every file in static/ to static/dist/ under a content-hashed
+name, writes gzip and brotli variants next to it and emits a manifest
+mapping the original path to the hashed one. The app then serves the
+hashed names with a far-future immutable Cache-Control header.
+"""
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+
+import brotli
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.staticfiles import StaticFiles
+
+from .config import STATIC_DIR
+
+DIST_DIR = "dist"
+MANIFEST_FILE = "manifest.json"
+HASH_LENGTH = 12
+IMMUTABLE = "public, max-age=31536000, immutable"
+# preferred order when the client accepts several
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map"}
+
+
+def parse_accept_encoding(header):
+    """Return the encodings of an Accept-Encoding header with a q > 0"""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _hashed_name(relpath, content):
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(relpath)
+    return f"{root}.{digest}{ext}"
+
+
+def _write_compressed(path, content):
+    gz_content = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gz_content) < len(content):
+        with open(path + ENCODINGS["gzip"], "wb") as f:
+            f.write(gz_content)
+
+    br_content = brotli.compress(content, quality=11)
+    if len(br_content) < len(content):
+        with open(path + ENCODINGS["br"], "wb") as f:
+            f.write(br_content)
+
+
+def build(static_dir=STATIC_DIR):
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relpath = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                content = f.read()
+
+            hashed = _hashed_name(relpath, content)
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(content)
+
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                _write_compressed(target, content)
+
+            manifest[relpath] = f"{DIST_DIR}/{hashed}"
+
+    with open(os.path.join(dist_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+@functools.lru_cache
+def load_manifest(static_dir=STATIC_DIR):
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # not built (local dev), serve the original files
+        return {}
+
+
+def asset_path(path, static_dir=STATIC_DIR):
+    manifest = load_manifest(static_dir)
+    hashed = manifest.get(path.lstrip("/"))
+    return f"/{hashed}" if hashed else path
+
+
+@pass_context
+def url_for(context, name, /, **path_params):
+    """Jinja url_for that resolves static paths through the manifest"""
+    request = context["request"]
+    if name == "static" and "path" in path_params:
+        path_params["path"] = asset_path(path_params["path"])
+    return request.url_for(name, **path_params)
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants of hashed assets"""
+
+    async def get_response(self, path, scope):
+        if not path.startswith(DIST_DIR + os.sep):
+            return await super().get_response(path, scope)
+
+        if scope["method"] in ("GET", "HEAD"):
+            accepted = parse_accept_encoding(
+                Headers(scope=scope).get("accept-encoding", "")
+            )
+            for encoding, ext in ENCODINGS.items():
+                if encoding not in accepted:
+                    continue
+                full_path, stat_result = self.lookup_path(path + ext)
+                if stat_result is None:
+                    continue
+                response = self.file_response(full_path, stat_result, scope)
+                media_type, _ = mimetypes.guess_type(path)
+                if media_type:
+                    response.headers["content-type"] = media_type
+                response.headers["content-encoding"] = encoding
+                response.headers["vary"] = "Accept-Encoding"
+                response.headers["cache-control"] = IMMUTABLE
+                return response
+
+        response = await super().get_response(path, scope)
+        response.headers["vary"] = "Accept-Encoding"
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = IMMUTABLE
+        return response
+
+
+def main(args, *, static_dir=STATIC_DIR):
+    parser = argparse.ArgumentParser("Build fingerprinted static assets")
+    parser.add_argument("-d", "--directory", default=static_dir)
+    args = parser.parse_args(args)
+
+    manifest = build(args.directory)
+    print(f"Built {len(manifest)} assets in {args.directory}/{DIST_DIR}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
@@ -1,11 +1,137 @@
 import os
-from typing import Optional
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
 
-import boto3
-
-from .config import AWS_S3_BUCKET, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+from .config import (
+    AWS_S3_BUCKET,
+    AWS_ACCESS_KEY_ID,
+    AWS_SECRET_ACCESS_KEY,
+    AWS_REGION,
+    S3_DELETE_INTERVAL,
+)
+from .metrics import S3_DELETES, S3_UPLOADS, S3_UPLOAD_BYTES, S3_UPLOAD_SECONDS, track
 
 DEFAULT_BUCKET_PERMISSION = "public-read"
+# most keys a single DeleteObjects request takes
+MAX_DELETE_BATCH = 1000
+
+
+def _s3():
+    # boto3 is slow to import, keep it out of app startup
+    import boto3
+
+    session = boto3.Session(
+        aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+    )
+    return session.resource("s3")
+
+
+def check_bucket(bucket: Optional[str] = None) -> None:
+    """Raise if the bucket doesn't exist or we have no access to it"""
+    _s3().meta.client.head_bucket(Bucket=bucket or AWS_S3_BUCKET)
+
+
+def s3_url(key: str, bucket: Optional[str] = None) -> str:
+    return f"https://{bucket or AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
+
+
+def s3_key(url: str, bucket: Optional[str] = None) -> Optional[str]:
+    """The key of an image url, None if the url isn't in our bucket"""
+    prefix = s3_url("", bucket)
+    return url[len(prefix) :] if url.startswith(prefix) else None
+
+
+def list_s3_objects(bucket: Optional[str] = None) -> Iterator[dict]:
+    """All objects in the bucket, in key (UTF-8 byte) order, a page at a time"""
+    paginator = _s3().meta.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket or AWS_S3_BUCKET):
+        yield from page.get("Contents", [])
+
+
+def delete_from_s3(keys: Iterable[str], bucket: Optional[str] = None) -> List[str]:
+    """Delete keys, MAX_DELETE_BATCH per request, return the keys that failed"""
+    client = _s3().meta.client
+    keys = list(keys)
+    failed = []
+    for i in range(0, len(keys), MAX_DELETE_BATCH):
+        batch = keys[i : i + MAX_DELETE_BATCH]
+        response = client.delete_objects(
+            Bucket=bucket or AWS_S3_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        errors = [error["Key"] for error in response.get("Errors", [])]
+        S3_DELETES.labels(outcome="ok").inc(len(batch) - len(errors))
+        S3_DELETES.labels(outcome="error").inc(len(errors))
+        failed.extend(errors)
+    return failed
+
+
+# (key, code_hash of the tip that showed it)
+QueuedImage = Tuple[str, Optional[str]]
+
+
+class DeleteQueue:
+    """
+    Deletes queued keys from a background thread, in one request per
+    MAX_DELETE_BATCH keys, at least every interval seconds.
+
+    Right before deleting, in_use is asked which of the keys a tip points
+    to again, e.g. a duplicate linked to the image after its tip was
+    deleted, and those are kept.
+
+    Keys still queued when the process dies (or failing to delete) stay in
+    the bucket until python -m tips.orphans sweeps them.
+    """
+
+    def __init__(
+        self,
+        interval: float = S3_DELETE_INTERVAL,
+        delete: Optional[Callable[[List[str]], List[str]]] = None,
+        in_use: Optional[Callable[[List[QueuedImage]], Set[str]]] = None,
+    ):
+        self.interval = interval
+        self._delete = delete or delete_from_s3
+        self._in_use = in_use
+        self._images: List[QueuedImage] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, key: str, code_hash: Optional[str] = None) -> None:
+        with self._lock:
+            self._images.append((key, code_hash))
+            full = len(self._images) >= MAX_DELETE_BATCH
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="s3-deletes", daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            images, self._images = self._images, []
+        if not images:
+            return
+        try:
+            used = self._in_use(images) if self._in_use is not None else set()
+            keys = [key for key, _ in images if key not in used]
+            if keys:
+                self._delete(keys)
+        except Exception:
+            S3_DELETES.labels(outcome="error").inc(len(images))
+            raise
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # counted, the sweeper gets these keys
+                pass
 
 
 def upload_to_s3(
@@ -14,13 +140,21 @@ def upload_to_s3(
     s3_bucket = bucket or AWS_S3_BUCKET
     acl = acl or DEFAULT_BUCKET_PERMISSION
 
-    session = boto3.Session(
-        aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-    )
-    s3 = session.resource("s3")
-    response = s3.Bucket(s3_bucket).put_object(
-        Key=os.path.basename(filepath), Body=open(filepath, "rb"), ACL=acl
-    )
+    s3 = _s3()
+    with track(S3_UPLOADS, S3_UPLOAD_SECONDS):
+        response = s3.Bucket(s3_bucket).put_object(
+            Key=os.path.basename(filepath), Body=open(filepath, "rb"), ACL=acl
+        )
+    S3_UPLOAD_BYTES.inc(os.path.getsize(filepath))
+
+    return s3_url(response.key, s3_bucket)
+
+
+def _images_in_use(images: List[QueuedImage]) -> Set[str]:
+    # the database layer imports the models, keep it out of this module
+    from .db import engine, image_keys_in_use
+
+    return image_keys_in_use(engine, images)
+
 
-    s3_file_link = f"https://{s3_bucket}.s3.{AWS_REGION}.amazonaws.com/{response.key}"
-    return s3_file_link
+delete_queue = DeleteQueue(in_use=_images_in_use)
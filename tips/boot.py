@@ -0,0 +1,105 @@
+"""
+Report how long it takes to import and boot the app
+
+    python -m tips.boot [--top 15] [--budget-ms 1500]
+
+Runs a fresh interpreter with -X importtime to break down the import of
+tips.main and another one that times the import plus the startup hooks,
+which is what every dyno boot and gunicorn worker spawn pays.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULE = "tips.main"
+BOOT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from tips.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app):
+    started = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "startup_ms": (started - imported) * 1000}))
+"""
+
+
+def parse_importtime(output):
+    """Parse -X importtime stderr into (module, self_us, cumulative_us, depth)"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2].rstrip()
+        # the name is indented two spaces per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return rows
+
+
+def _run(args):
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+def import_report(module=MODULE):
+    result = _run(["-X", "importtime", "-c", f"import {module}"])
+    return parse_importtime(result.stderr)
+
+
+def boot_report():
+    result = _run(["-c", BOOT_SCRIPT])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    parser = argparse.ArgumentParser("Import and boot time report")
+    parser.add_argument("-m", "--module", default=MODULE)
+    parser.add_argument("-t", "--top", type=int, default=15)
+    parser.add_argument(
+        "-b", "--budget-ms", type=float, help="exit non-zero above this import time"
+    )
+    args = parser.parse_args(args)
+
+    rows = import_report(args.module)
+    index = next(i for i, row in enumerate(rows) if row[0] == args.module)
+    total_ms = rows[index][2] / 1000
+
+    # nested imports are reported before the module that triggered them
+    start = index
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    # direct dependencies of the app, what we could make lazy
+    children = [row for row in rows[start:index] if row[3] == 1]
+    print(f"import {args.module}: {total_ms:.1f} ms\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  package")
+    for name, self_us, cumulative_us, _ in sorted(
+        children, key=lambda row: row[2], reverse=True
+    )[: args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    print(f"\nslowest modules by self time ({os.path.basename(sys.executable)}):")
+    for name, self_us, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[
+        : args.top
+    ]:
+        print(f"{self_us / 1000:>14.1f}  {name}")
+
+    boot = boot_report()
+    print(
+        f"\nboot: import {boot['import_ms']:.1f} ms"
+        f" + startup hooks {boot['startup_ms']:.1f} ms"
+    )
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        sys.exit(f"import time {total_ms:.1f} ms exceeds budget {args.budget_ms} ms")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,305 @@
+"""
+Move tips between environments as NDJSON (one JSON object per line)
+
+    python -m tips.bulk export [-o tips.ndjson] [--since 2022-01-01]
+    python -m tips.bulk import tips.ndjson [--urls preserve|rerender]
+
+Export streams from a server side cursor so memory stays constant.
+Import inserts a batch per transaction, in multi-row INSERT ... RETURNING
+statements on PostgreSQL, and records the last committed line in a
+checkpoint file, rerunning the same command resumes from there. Tips are
+linked to users by username, rows of users that don't exist in the target
+database and titles the user already has are skipped and reported.
+"""
+import argparse
+import csv
+from datetime import datetime
+import io
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+from sqlmodel import select
+
+from .aws import delete_from_s3, s3_key
+from .db import (
+    EXPORT_COLUMNS,
+    dialect_insert,
+    engine as default_engine,
+    hash_code,
+    iter_tips,
+)
+from .models import Tip, TipStats, User
+from .render import render_and_upload
+
+PRESERVE = "preserve"
+RERENDER = "rerender"
+NDJSON = "ndjson"
+CSV = "csv"
+INSERT_BATCH = 1000
+
+
+def _serialize(row):
+    data = dict(row)
+    if data["added"] is not None:
+        data["added"] = data["added"].isoformat()
+    return json.dumps(data, ensure_ascii=False)
+
+
+def export_tips(engine, out, *, since=None, fetch_size=500):
+    count = 0
+    with engine.connect() as connection:
+        for row in iter_tips(connection, since=since, fetch_size=fetch_size):
+            out.write(_serialize(row) + "\n")
+            count += 1
+    return count
+
+
+def stream_export(engine, fmt=NDJSON, *, since=None, fetch_size=500):
+    """
+    Yield public tips as NDJSON or CSV text, one chunk per fetch_size rows
+
+    Opens its own connection so it can outlive the request's session,
+    e.g. as the body of a StreamingResponse.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == CSV:
+        writer.writerow((*EXPORT_COLUMNS, "username"))
+    rows = 0
+    with engine.connect() as connection:
+        for row in iter_tips(
+            connection, since=since, public_only=True, fetch_size=fetch_size
+        ):
+            if fmt == CSV:
+                writer.writerow(row.values())
+            else:
+                buffer.write(_serialize(row) + "\n")
+            rows += 1
+            if rows % fetch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)["line"]
+    except FileNotFoundError:
+        return 0
+
+
+def _write_checkpoint(path, line):
+    # write + rename so a crash never leaves a truncated checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"line": line}, f)
+    os.replace(tmp, path)
+
+
+def _to_row(data, user_id, urls):
+    row = {name: data.get(name) for name in EXPORT_COLUMNS}
+    row["user_id"] = user_id
+    row["public"] = True if row["public"] is None else row["public"]
+    row["added"] = (
+        datetime.fromisoformat(row["added"]) if row["added"] else datetime.utcnow()
+    )
+    row["code_hash"] = hash_code(row["code"])
+    if urls == RERENDER:
+        tip = SimpleNamespace(**row)
+        row["url"] = render_and_upload(tip, data["username"])
+    return row
+
+
+def _insert_batch(engine, batch, urls):
+    """
+    Insert one batch in a single transaction, return the skipped rows as
+    [(line number, reason), ...]
+    """
+    usernames = {data.get("username") for _, data in batch}
+    titles = {data.get("title") for _, data in batch}
+    with engine.connect() as connection:
+        user_ids = dict(
+            connection.execute(
+                select(User.username, User.id).where(User.username.in_(usernames))
+            ).all()
+        )
+        taken = {
+            tuple(row)
+            for row in connection.execute(
+                select(Tip.user_id, Tip.title).where(
+                    Tip.user_id.in_(user_ids.values()), Tip.title.in_(titles)
+                )
+            )
+        }
+
+    pending, skipped = [], []
+    for line_number, data in batch:
+        username, title = data.get("username"), data.get("title")
+        user_id = user_ids.get(username)
+        if user_id is None:
+            skipped.append((line_number, f"unknown user {username!r}"))
+            continue
+        if (user_id, title) in taken:
+            skipped.append(
+                (line_number, f"{username} already has a tip titled {title!r}")
+            )
+            continue
+        # also catches repeats within the batch
+        taken.add((user_id, title))
+        # rendering happens here, outside of the insert transaction
+        pending.append((line_number, username, _to_row(data, user_id, urls)))
+
+    if pending:
+        rows = [row for _, _, row in pending]
+        with engine.begin() as connection:
+            inserted = _insert_rows(connection, rows)
+            _add_stats_rows(connection, {row["user_id"] for row in rows})
+        # titles added concurrently since the lookup
+        conflicts = [
+            (line_number, username, row)
+            for line_number, username, row in pending
+            if (row["user_id"], row["title"]) not in inserted
+        ]
+        for line_number, username, row in conflicts:
+            skipped.append(
+                (line_number, f"{username} already has a tip titled {row['title']!r}")
+            )
+        if urls == RERENDER and conflicts:
+            # every render gets its own key, no other tip points to these
+            delete_from_s3([s3_key(row["url"]) for _, _, row in conflicts])
+        skipped.sort()
+    return skipped
+
+
+def _insert_rows(connection, rows):
+    """
+    Insert rows, skipping titles the user already has, return the
+    (user_id, title) pairs that were inserted
+    """
+    table = Tip.__table__
+    insert = dialect_insert(connection.dialect)
+    statement = insert(table).on_conflict_do_nothing(
+        index_elements=[table.c.user_id, table.c.title]
+    )
+    if connection.dialect.name != "postgresql":
+        # no RETURNING for SQLite in SQLAlchemy 1.4, one row at a time
+        return {
+            (row["user_id"], row["title"])
+            for row in rows
+            if connection.execute(statement, row).rowcount
+        }
+    inserted = set()
+    # multi-row VALUES, bound parameters per statement are limited
+    for i in range(0, len(rows), INSERT_BATCH):
+        result = connection.execute(
+            statement.values(rows[i : i + INSERT_BATCH]).returning(
+                table.c.user_id, table.c.title
+            )
+        )
+        inserted.update(tuple(row) for row in result)
+    return inserted
+
+
+def _add_stats_rows(connection, user_ids):
+    """Zero tip_stats rows for the users' tips without one, see publish_tip"""
+    tip_table, stats_table = Tip.__table__, TipStats.__table__
+    missing = (
+        select(tip_table.c.id)
+        .select_from(tip_table.outerjoin(stats_table))
+        .where(tip_table.c.user_id.in_(user_ids), stats_table.c.tip_id.is_(None))
+    )
+    connection.execute(stats_table.insert().from_select(["tip_id"], missing))
+
+
+def import_tips(engine, lines, *, batch_size=500, urls=PRESERVE, checkpoint=None):
+    start = _read_checkpoint(checkpoint) if checkpoint else 0
+    imported = 0
+    skipped = []
+    batch = []
+
+    def flush(line_number):
+        nonlocal imported
+        batch_skipped = _insert_batch(engine, batch, urls)
+        imported += len(batch) - len(batch_skipped)
+        skipped.extend(batch_skipped)
+        batch.clear()
+        if checkpoint:
+            _write_checkpoint(checkpoint, line_number)
+
+    line_number = start
+    for line_number, line in enumerate(lines, start=1):
+        if line_number <= start or not line.strip():
+            continue
+        batch.append((line_number, json.loads(line)))
+        if len(batch) >= batch_size:
+            flush(line_number)
+    if batch:
+        flush(line_number)
+    return imported, skipped
+
+
+def main(args, *, engine=None):
+    engine = engine or default_engine
+
+    parser = argparse.ArgumentParser("Bulk export/import tips as NDJSON")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("-o", "--output", help="file, defaults to stdout")
+    export_parser.add_argument(
+        "-s", "--since", type=datetime.fromisoformat, help="only tips added since"
+    )
+    export_parser.add_argument("-f", "--fetch-size", type=int, default=500)
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("input", help="NDJSON file, - for stdin")
+    import_parser.add_argument("-b", "--batch-size", type=int, default=500)
+    import_parser.add_argument(
+        "-u", "--urls", choices=[PRESERVE, RERENDER], default=PRESERVE
+    )
+    import_parser.add_argument(
+        "-c", "--checkpoint", help="defaults to <input>.checkpoint"
+    )
+
+    args = parser.parse_args(args)
+
+    if args.command == "export":
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            count = export_tips(
+                engine, out, since=args.since, fetch_size=args.fetch_size
+            )
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"Exported {count} tips", file=sys.stderr)
+        return
+
+    checkpoint = args.checkpoint
+    if checkpoint is None and args.input != "-":
+        checkpoint = f"{args.input}.checkpoint"
+    f = sys.stdin if args.input == "-" else open(args.input)
+    try:
+        imported, skipped = import_tips(
+            engine,
+            f,
+            batch_size=args.batch_size,
+            urls=args.urls,
+            checkpoint=checkpoint,
+        )
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    print(f"Imported {imported} tips")
+    for line_number, reason in skipped:
+        print(f"Skipped line {line_number}: {reason}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
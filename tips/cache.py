@@ -0,0 +1,204 @@
+from collections import OrderedDict, defaultdict
+import threading
+import time
+
+from .config import (
+    LISTING_CACHE_SIZE,
+    LISTING_CACHE_TTL,
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL,
+    SEARCH_STATS_SIZE,
+)
+from .metrics import CACHE_LOOKUPS
+
+# bumped on tip create/delete, part of every cache key so stale
+# entries are never hit again and age out of the LRU
+_generation = 0
+
+
+def generation():
+    return _generation
+
+
+def bump_generation():
+    global _generation
+    _generation += 1
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl, name="default"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        result = "miss" if value is None else "hit"
+        CACHE_LOOKUPS.labels(cache=self.name, result=result).inc()
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return None
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LFUCache:
+    """
+    Thread safe cache that evicts the least frequently used entry, the
+    least recently used one among those with the same count, so a burst
+    of one-off keys can't push out the popular ones. Emptied when the
+    generation changes, which only happens for this worker's writes, so
+    entries also expire after ttl seconds like in TTLCache.
+    """
+
+    def __init__(self, maxsize, ttl, name="default"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires, value)
+        self._values = {}
+        self._counts = {}
+        # use count -> keys in least recently used first order
+        self._buckets = defaultdict(OrderedDict)
+        self._min_count = 0
+        self._generation = generation()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            self._check_generation()
+            expires, value = self._values.get(key, (None, None))
+            if value is not None and expires < time.monotonic():
+                self._remove(key)
+                value = None
+            if value is not None:
+                self._touch(key)
+        result = "miss" if value is None else "hit"
+        CACHE_LOOKUPS.labels(cache=self.name, result=result).inc()
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_generation()
+            expires = time.monotonic() + self.ttl
+            if key in self._values:
+                self._values[key] = (expires, value)
+                self._touch(key)
+                return
+            if len(self._values) >= self.maxsize:
+                evicted, _ = self._buckets[self._min_count].popitem(last=False)
+                if not self._buckets[self._min_count]:
+                    del self._buckets[self._min_count]
+                del self._values[evicted], self._counts[evicted]
+            self._values[key] = (expires, value)
+            self._counts[key] = 1
+            self._buckets[1][key] = None
+            self._min_count = 1
+
+    def _touch(self, key):
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets[count + 1][key] = None
+
+    def _remove(self, key):
+        count = self._counts.pop(key)
+        del self._values[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+        # eviction pops from the _min_count bucket, it must exist
+        if self._min_count == count and count not in self._buckets:
+            self._min_count = min(self._buckets, default=0)
+
+    def _check_generation(self):
+        if self._generation != generation():
+            self._clear()
+            self._generation = generation()
+
+    def _clear(self):
+        self._values.clear()
+        self._counts.clear()
+        self._buckets.clear()
+        self._min_count = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class TermStats:
+    """
+    Hit/miss counts per search term, the least searched terms are dropped
+    once there are more than maxsize
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, term, hit):
+        with self._lock:
+            hits, misses = self._counts.get(term, (0, 0))
+            self._counts[term] = (hits + 1, misses) if hit else (hits, misses + 1)
+            if len(self._counts) > self.maxsize:
+                # prune to half in one go instead of on every new term
+                keep = self._ranked()[: self.maxsize // 2]
+                self._counts = {term: (hits, misses) for term, hits, misses in keep}
+
+    def _ranked(self):
+        return sorted(
+            ((term, hits, misses) for term, (hits, misses) in self._counts.items()),
+            key=lambda row: row[1] + row[2],
+            reverse=True,
+        )
+
+    def top(self, n=None):
+        """[(term, hits, misses), ...] most searched first"""
+        with self._lock:
+            return self._ranked()[:n]
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+listing_cache = TTLCache(LISTING_CACHE_SIZE, LISTING_CACHE_TTL, name="listing")
+search_cache = LFUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, name="search")
+search_stats = TermStats(SEARCH_STATS_SIZE)
@@ -0,0 +1,146 @@
+import gzip
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from .assets import parse_accept_encoding
+from .cache import generation, listing_cache
+
+# preferred order when the client accepts several
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+
+
+def compress(body, encoding, level):
+    """Level is used as gzip compresslevel (1-9) and brotli quality (0-11)"""
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level)
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip/brotli compression of buffered (non streaming) responses
+
+    route_levels overrides the compression level per path. GET responses
+    for cached_paths are stored in the listing cache already compressed,
+    keyed on path, query string, host, encoding and cache generation, so
+    repeated hits skip both the endpoint and the compression. The host is
+    part of the key because the pages embed absolute url_for links.
+    """
+
+    def __init__(
+        self,
+        app,
+        *,
+        minimum_size=500,
+        level=6,
+        route_levels=None,
+        cached_paths=(),
+        cache=listing_cache,
+        exclude_prefixes=("/static",),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.route_levels = route_levels or {}
+        self.cached_paths = set(cached_paths)
+        self.cache = cache
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+        encoding = next((e for e in ENCODINGS if e in accepted), None)
+
+        cache_key = None
+        if scope["method"] == "GET" and scope["path"] in self.cached_paths:
+            cache_key = (
+                scope["path"],
+                scope["query_string"],
+                request_headers.get("host", ""),
+                encoding,
+                generation(),
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                status, raw_headers, body = cached
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": status,
+                        "headers": raw_headers,
+                    }
+                )
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        if encoding is None and cache_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        level = self.route_levels.get(scope["path"], self.level)
+        responder = _CompressionResponder(
+            send, encoding, level, self.minimum_size, self.cache, cache_key
+        )
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, send, encoding, level, minimum_size, cache, cache_key):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.cache = cache
+        self.cache_key = cache_key
+        self.start_message = None
+        self.passthrough = False
+        self.chunks = []
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            # hold back until we know whether we are going to compress
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        if not self.chunks:
+            headers = Headers(raw=self.start_message["headers"])
+            content_type = headers.get("content-type", "")
+            # streaming responses have no content-length, leave them alone
+            if (
+                "content-encoding" in headers
+                or "content-length" not in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+
+        self.chunks.append(message.get("body", b""))
+        if message.get("more_body", False):
+            return
+
+        body = b"".join(self.chunks)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if self.encoding is not None and len(body) >= self.minimum_size:
+            body = compress(body, self.encoding, self.level)
+            headers["content-encoding"] = self.encoding
+            headers["content-length"] = str(len(body))
+        headers.add_vary_header("Accept-Encoding")
+
+        status = self.start_message["status"]
+        if self.cache_key is not None and status == 200:
+            self.cache.set(self.cache_key, (status, headers.raw, body))
+
+        await self._send(self.start_message)
+        await self._send({"type": "http.response.body", "body": body})
@@ -1,9 +1,13 @@
+import os
 from pathlib import Path
+import tempfile
 
 from decouple import config
 
 
 DATABASE_URL = config("DATABASE_URL")
+# optional read replica for the read only endpoints
+DATABASE_REPLICA_URL = config("DATABASE_REPLICA_URL", default="")
 DEBUG = config("DEBUG", default=False, cast=bool)
 
 if DEBUG:
@@ -15,8 +19,59 @@ else:  # pragma: no cover
     # https://help.heroku.com/ZKNTJQSK/why-is-sqlalchemy-1-4-x-not-connecting-to-heroku-postgres
     if DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    if DATABASE_REPLICA_URL.startswith("postgres://"):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace(
+            "postgres://", "postgresql://", 1
+        )
 
-USER_DIR = "/tmp/{user_id}"
+# reads go to the primary while the replica lags more than this (seconds)
+# or is down, checked at most every REPLICA_CHECK_INTERVAL seconds
+REPLICA_MAX_LAG = config("REPLICA_MAX_LAG", default=10, cast=int)
+REPLICA_CHECK_INTERVAL = config("REPLICA_CHECK_INTERVAL", default=5, cast=int)
+# seconds, a replica that stops answering fails the check instead of hanging it
+REPLICA_CONNECT_TIMEOUT = config("REPLICA_CONNECT_TIMEOUT", default=2, cast=int)
+# Alembic manages the schema in production (Procfile release phase)
+CREATE_DB_AND_TABLES = config("CREATE_DB_AND_TABLES", default=DEBUG, cast=bool)
+# render jobs get their own dir in here, RAM backed if possible
+SCRATCH_DIR = config(
+    "SCRATCH_DIR",
+    default="/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+)
+# scratch dirs older than this (seconds) are swept on startup
+SCRATCH_MAX_AGE = config("SCRATCH_MAX_AGE", default=600, cast=int)
+# what to do when the same (normalized) code is posted again:
+# "link" reuses the existing image if it would look the same, "reject" refuses it
+DUPLICATE_CODE_POLICY = config("DUPLICATE_CODE_POLICY", default="link")
+STATIC_DIR = config("STATIC_DIR", default="static")
+# snippets over these limits are refused on create
+MAX_CODE_LINES = config("MAX_CODE_LINES", default=500, cast=int)
+MAX_LINE_LENGTH = config("MAX_LINE_LENGTH", default=300, cast=int)
+MAX_CODE_BYTES = config("MAX_CODE_BYTES", default=30_000, cast=int)
+# snippets costing up to this many 80 column lines render in the fast lane
+FAST_RENDER_MAX_COST = config("FAST_RENDER_MAX_COST", default=60, cast=int)
+# concurrent renders per worker and lane
+FAST_RENDER_CONCURRENCY = config("FAST_RENDER_CONCURRENCY", default=2, cast=int)
+SLOW_RENDER_CONCURRENCY = config("SLOW_RENDER_CONCURRENCY", default=1, cast=int)
+# seconds a request waits for a render slot before giving up with a 503
+RENDER_QUEUE_TIMEOUT = config("RENDER_QUEUE_TIMEOUT", default=20, cast=int)
+# seconds the response to a POST /create with an Idempotency-Key is kept
+IDEMPOTENCY_KEY_TTL = config("IDEMPOTENCY_KEY_TTL", default=24 * 3600, cast=int)
+# seconds a request holds its key while in progress, a retry after that
+# takes over (the worker died), keep it above the slowest create
+IDEMPOTENCY_LEASE = config("IDEMPOTENCY_LEASE", default=120, cast=int)
+# view/copy/download counts are written to the DB this often (seconds),
+# for at most STATS_MAX_TIPS different tips per worker in between
+STATS_FLUSH_INTERVAL = config("STATS_FLUSH_INTERVAL", default=30, cast=int)
+STATS_MAX_TIPS = config("STATS_MAX_TIPS", default=10_000, cast=int)
+# an event of a client for a tip counts once per this many seconds, for
+# the last STATS_DEDUPE_SIZE (client, tip, event) combinations per worker
+STATS_DEDUPE_WINDOW = config("STATS_DEDUPE_WINDOW", default=3600, cast=int)
+STATS_DEDUPE_SIZE = config("STATS_DEDUPE_SIZE", default=100_000, cast=int)
+# startup warm-up: DB connections to open per worker, render a test snippet
+WARMUP_DB_CONNECTIONS = config("WARMUP_DB_CONNECTIONS", default=2, cast=int)
+WARMUP_RENDER = config("WARMUP_RENDER", default=not DEBUG, cast=bool)
+# seconds /readyz reuses renderer and storage check results
+HEALTH_CHECK_TTL = config("HEALTH_CHECK_TTL", default=30, cast=int)
 SECRET_KEY = config("SECRET_KEY")
 ALGORITHM = config("ALGORITHM", default="HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = config(
@@ -32,3 +87,15 @@ AWS_S3_BUCKET = config("AWS_S3_BUCKET", default="")
 AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID", default="")
 AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY", default="")
 AWS_REGION = config("AWS_REGION", default="")
+# images of deleted tips are removed from S3 in batches, at least this often
+S3_DELETE_INTERVAL = config("S3_DELETE_INTERVAL", default=5, cast=int)
+COMPRESSION_LEVEL = config("COMPRESSION_LEVEL", default=6, cast=int)
+COMPRESSION_MINIMUM_SIZE = config("COMPRESSION_MINIMUM_SIZE", default=500, cast=int)
+LISTING_CACHE_SIZE = config("LISTING_CACHE_SIZE", default=256, cast=int)
+LISTING_CACHE_TTL = config("LISTING_CACHE_TTL", default=60, cast=int)
+SEARCH_CACHE_SIZE = config("SEARCH_CACHE_SIZE", default=512, cast=int)
+SEARCH_CACHE_TTL = config("SEARCH_CACHE_TTL", default=60, cast=int)
+# number of distinct search terms to keep hit statistics for
+SEARCH_STATS_SIZE = config("SEARCH_STATS_SIZE", default=1000, cast=int)
+# rebuild the /suggest index after this many seconds to see other workers' writes
+SUGGEST_MAX_AGE = config("SUGGEST_MAX_AGE", default=300, cast=int)
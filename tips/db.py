@@ -1,20 +1,135 @@
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+import functools
 import hashlib
 import secrets
+import textwrap
+import threading
+import time
 
 from sqlmodel import Session, SQLModel, create_engine, select, or_
-from passlib.context import CryptContext
-from sqlalchemy import func
+from sqlalchemy import delete, func, text
+from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import IntegrityError
+
+from .aws import s3_url
+from .cache import bump_generation
+from .config import (
+    DATABASE_REPLICA_URL,
+    DATABASE_URL,
+    DEBUG,
+    REPLICA_CHECK_INTERVAL,
+    REPLICA_CONNECT_TIMEOUT,
+    REPLICA_MAX_LAG,
+)
+from .metrics import instrument_engine
+from .models import IdempotencyKey, User, UserCreate, Tip, TipStats
+
+
+def replica_connect_args(url, timeout=REPLICA_CONNECT_TIMEOUT):
+    """
+    Connect timeout for the replica, the check runs inside a request and
+    would otherwise wait for the OS to give up on an unresponsive host
+    """
+    if url.startswith("postgresql"):
+        return {"connect_timeout": timeout}
+    return {}
 
-from .config import DATABASE_URL, DEBUG
-from .models import User, UserCreate, Tip
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 engine = create_engine(DATABASE_URL, echo=DEBUG)
+instrument_engine(engine)
+replica_engine = None
+if DATABASE_REPLICA_URL:
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL,
+        echo=DEBUG,
+        connect_args=replica_connect_args(DATABASE_REPLICA_URL),
+    )
+    instrument_engine(replica_engine)
+
+# seconds the replica is behind, 0 when caught up or not replicating
+REPLICA_LAG_SQL = text(
+    """
+    SELECT COALESCE(
+        CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END,
+        0
+    )
+    """
+)
+
+
+class ReplicaRouter:
+    """
+    Engine for read only sessions: the replica while it answers and lags
+    at most max_lag seconds behind, else the primary. The replica is
+    checked at most every interval seconds, by one thread at a time.
+
+    For max_lag seconds after a write of this worker reads go to the
+    primary as well, the replica may not have it yet and what is read
+    right after a write fills the listing and search caches.
+    """
+
+    def __init__(self, primary, replica, *, max_lag, interval):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.interval = interval
+        self.healthy = False
+        self._checked = None
+        self._written = None
+        self._lock = threading.Lock()
+
+    def replica_lag(self):
+        with self.replica.connect() as connection:
+            if connection.dialect.name != "postgresql":
+                return 0
+            return connection.execute(REPLICA_LAG_SQL).scalar()
+
+    def check(self):
+        try:
+            self.healthy = self.replica_lag() <= self.max_lag
+        except Exception:
+            self.healthy = False
+        self._checked = time.monotonic()
+
+    def note_write(self):
+        self._written = time.monotonic()
+
+    def engine(self):
+        if self.replica is None:
+            return self.primary
+        if (
+            self._written is not None
+            and time.monotonic() - self._written < self.max_lag
+        ):
+            return self.primary
+        due = self._checked is None or time.monotonic() - self._checked >= self.interval
+        # others keep using the last result while one thread checks
+        if due and self._lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self._lock.release()
+        return self.replica if self.healthy else self.primary
+
+
+read_router = ReplicaRouter(
+    engine,
+    replica_engine,
+    max_lag=REPLICA_MAX_LAG,
+    interval=REPLICA_CHECK_INTERVAL,
+)
 
 
 def get_session():
-    with Session(engine) as session:
+    # no refresh SELECTs after commit, what we wrote is what's in the db
+    with Session(engine, expire_on_commit=False) as session:
+        yield session
+
+
+def get_read_session():
+    """For read only endpoints, on the replica if there's a healthy one"""
+    with Session(read_router.engine(), expire_on_commit=False) as session:
         yield session
 
 
@@ -32,12 +147,30 @@ def _generate_activation_key(username):
     return hashlib.sha256((secret_key + username).encode("utf-8")).hexdigest()
 
 
+@functools.lru_cache
+def _pwd_context():
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def normalize_code(code):
+    """Normalize newlines, trailing whitespace, indentation and blank edges"""
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    code = "\n".join(line.rstrip() for line in lines)
+    return textwrap.dedent(code).strip("\n")
+
+
+def hash_code(code):
+    return hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+
+
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _pwd_context().hash(password)
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return _pwd_context().verify(plain_password, hashed_password)
 
 
 def get_user_by_activation_key(session, key):
@@ -61,20 +194,32 @@ def get_user_by_username(session, username):
     return user
 
 
-def email_used_by_user(session, email):
-    query = select(User).where(User.email == email)
-    return len(session.exec(query).all()) > 0
+def get_taken_usernames_and_emails(session, usernames, emails):
+    """Return the (usernames, emails) sets already in use, in one query"""
+    query = select(User.username, User.email).where(
+        or_(User.username.in_(usernames), User.email.in_(emails))
+    )
+    rows = session.exec(query).all()
+    return {row.username for row in rows}, {row.email for row in rows}
 
 
-def create_user(session, username, email, password):
-    encrypted_pw = get_password_hash(password)
+def new_user(username, email, encrypted_pw):
     user = UserCreate(username=username, email=email, password=encrypted_pw)
     db_user = User.from_orm(user)
     db_user.activation_key = _generate_activation_key(username)
     db_user.key_expires = datetime.utcnow() + timedelta(days=2)
+    return db_user
+
+
+def create_user(session, username, email, password):
+    encrypted_pw = get_password_hash(password)
+    db_user = new_user(username, email, encrypted_pw)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise
     return db_user
 
 
@@ -96,30 +241,200 @@ def get_tip_by_id(session, tip_id):
     return tip
 
 
+def _tips_changed():
+    bump_generation()
+    read_router.note_write()
+
+
 def delete_this_tip(session, tip):
+    # SQLite only cascades with PRAGMA foreign_keys on, and it hands the id
+    # of the newest tip out again, the next tip's zero row would collide
+    session.execute(delete(TipStats).where(TipStats.tip_id == tip.id))
     session.delete(tip)
     session.commit()
+    _tips_changed()
 
 
-def get_tip_by_title(session, title, user):
-    query = select(Tip).where(Tip.title == title, Tip.user == user)
-    tip = session.exec(query).first()
-    return tip
+def image_in_use(session, url, code_hash=None):
+    """Does any tip show the image at url? Tips share images by code_hash."""
+    query = select(Tip.id).where(Tip.url == url)
+    if code_hash is not None:
+        # served by ix_tip_code_hash, url has no index
+        query = query.where(Tip.code_hash == code_hash)
+    return session.exec(query.limit(1)).first() is not None
+
+
+def image_keys_in_use(bind, images):
+    """
+    The keys of images, (key, code_hash) pairs, that a tip points to, e.g.
+    a duplicate linked to the image after the delete was queued
+    """
+    urls = {s3_url(key): key for key, _ in images}
+    hashes = {code_hash for _, code_hash in images if code_hash is not None}
+    if not hashes:
+        # linking goes by code_hash, images without one can't be reused
+        return set()
+    # served by ix_tip_code_hash, url has no index
+    query = select(Tip.url).where(Tip.code_hash.in_(hashes), Tip.url.in_(urls))
+    with Session(bind) as session:
+        return {urls[url] for url in session.exec(query)}
+
+
+def get_tips_by_code_hash(session, code_hash):
+    query = select(Tip).where(Tip.code_hash == code_hash)
+    return session.exec(query).all()
+
+
+def dialect_insert(dialect):
+    """The insert construct with on_conflict_* support of the dialect"""
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
 
 
-def create_new_tip(session, tip, url, user):
+def tip_title_taken(session, user, title):
+    query = select(Tip.id).where(Tip.user_id == user.id, Tip.title == title)
+    return session.exec(query.limit(1)).first() is not None
+
+
+def add_tip(session, tip, user, code_hash=None, url=None):
+    """
+    Insert tip without committing, a title the user already used raises
+    IntegrityError here (unique index ix_tip_user_id_title).
+    """
     db_tip = Tip.from_orm(tip)
     db_tip.url = url
     db_tip.user = user
     db_tip.language = db_tip.language.lower()
+    db_tip.code_hash = code_hash or hash_code(db_tip.code)
     session.add(db_tip)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        raise
+    return db_tip
+
+
+def publish_tip(session, db_tip):
+    # a zero row so the inner join of sort=popular lists it right away
+    session.add(TipStats(tip_id=db_tip.id))
     session.commit()
-    session.refresh(db_tip)
+    _tips_changed()
     return db_tip
 
 
-def get_all_tips(session, offset, limit, term=None):
-    statement = select(Tip)
+def claim_idempotency_key(session, user, key, request_hash, lease):
+    """
+    Record that the user's request with this key is in progress, for at
+    most lease seconds.
+
+    Returns (claim, None) for a new key, (None, earlier) when the key is
+    in use, earlier being None if it was released in the meantime.
+    Expired keys of the user are removed, so they can be used again. That
+    includes in progress claims whose lease ran out, e.g. because the
+    worker handling them was killed.
+    """
+    now = datetime.now(timezone.utc)
+    # not evaluated against loaded objects, SQLite hands back naive datetimes
+    session.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user.id, IdempotencyKey.expires < now)
+        .execution_options(synchronize_session=False)
+    )
+    claim = IdempotencyKey(
+        user_id=user.id,
+        key=key,
+        request_hash=request_hash,
+        expires=now + timedelta(seconds=lease),
+    )
+    session.add(claim)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return None, session.get(IdempotencyKey, (user.id, key))
+    return claim, None
+
+
+def set_idempotent_response(claim, status_code, body, ttl):
+    """Store the outcome on the claim, kept for ttl seconds once committed"""
+    claim.status_code = status_code
+    claim.response = body
+    claim.expires = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+
+
+def save_idempotent_response(session, claim, status_code, body, ttl):
+    set_idempotent_response(claim, status_code, body, ttl)
+    session.add(claim)
+    session.commit()
+
+
+def release_idempotency_key(session, claim):
+    """Let a retry with the same key run again, e.g. after a server error"""
+    # a failed flush or commit leaves the session waiting for a rollback
+    session.rollback()
+    session.delete(claim)
+    session.commit()
+
+
+EXPORT_COLUMNS = (
+    "title",
+    "code",
+    "description",
+    "language",
+    "background",
+    "theme",
+    "wt",
+    "public",
+    "added",
+    "url",
+)
+
+
+def iter_tips(connection, *, since=None, public_only=False, fetch_size=500):
+    """
+    Yield tips plus their author's username as row mappings, oldest first
+
+    Rows are streamed from a server side cursor fetch_size at a time so
+    memory stays flat regardless of the table size.
+    """
+    tip_table, user_table = Tip.__table__, User.__table__
+    columns = [tip_table.c[name] for name in EXPORT_COLUMNS]
+    statement = (
+        select(*columns, user_table.c.username)
+        .select_from(tip_table.outerjoin(user_table))
+        .order_by(tip_table.c.added, tip_table.c.id)
+    )
+    if since is not None:
+        statement = statement.where(tip_table.c.added >= since)
+    if public_only:
+        statement = statement.where(tip_table.c.public == True)  # noqa: E712
+    result = connection.execution_options(
+        stream_results=True, max_row_buffer=fetch_size
+    ).execute(statement)
+    for partition in result.mappings().partitions(fetch_size):
+        yield from partition
+
+
+NEWEST = "newest"
+POPULAR = "popular"
+
+
+def get_all_tips(
+    session, offset, limit, term=None, language=None, username=None, sort=NEWEST
+):
+    # listings only show the author's username, load just that in one
+    # extra SELECT ... WHERE user.id IN (...) for the whole page
+    statement = select(Tip).options(selectinload(Tip.user).load_only(User.username))
+    # served by the (language, added) and (user_id, added) indexes
+    if language is not None:
+        statement = statement.where(Tip.language == language.lower())
+    if username is not None:
+        user_id = select(User.id).where(User.username == username)
+        statement = statement.where(Tip.user_id == user_id.scalar_subquery())
     if term is not None:
         term = term.lower()
         statement = statement.where(
@@ -129,7 +444,14 @@ def get_all_tips(session, offset, limit, term=None):
                 func.lower(Tip.description).contains(term),
             )
         )
+    if sort == POPULAR:
+        # served by ix_tip_stats_score, every tip gets a zero row when it's
+        # inserted (the migration added them for the existing ones)
+        statement = statement.join(TipStats).order_by(
+            TipStats.score.desc(), TipStats.tip_id.desc()
+        )
+    else:
+        statement = statement.order_by(Tip.added.desc())
     statement = statement.offset(offset).limit(limit)
-    statement = statement.order_by(Tip.added.desc())
     tips = session.exec(statement).all()
     return tips
@@ -0,0 +1,85 @@
+"""
+Backfill Tip.code_hash for existing rows and report duplicate clusters
+
+    python -m tips.dedup [--batch-size 500] [--report-only]
+"""
+import argparse
+import sys
+
+from sqlalchemy import bindparam, func, update
+from sqlmodel import Session, select
+
+from .db import engine as default_engine, hash_code
+from .models import Tip, User
+
+
+def backfill(session, batch_size):
+    """Hash rows without a code_hash, batch by batch, return the count"""
+    statement = (
+        update(Tip.__table__)
+        .where(Tip.__table__.c.id == bindparam("tip_id"))
+        .values(code_hash=bindparam("code_hash"))
+    )
+    done = 0
+    last_id = 0
+    while True:
+        rows = session.exec(
+            select(Tip.id, Tip.code)
+            .where(Tip.code_hash == None, Tip.id > last_id)  # noqa: E711
+            .order_by(Tip.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return done
+        session.execute(
+            statement,
+            [{"tip_id": tip_id, "code_hash": hash_code(code)} for tip_id, code in rows],
+        )
+        session.commit()
+        done += len(rows)
+        last_id = rows[-1][0]
+
+
+def duplicate_clusters(session):
+    """Yield (code_hash, [(tip id, title, username), ...]) for duplicated code"""
+    hashes = session.exec(
+        select(Tip.code_hash, func.count(Tip.id).label("copies"))
+        .where(Tip.code_hash != None)  # noqa: E711
+        .group_by(Tip.code_hash)
+        .having(func.count(Tip.id) > 1)
+        .order_by(func.count(Tip.id).desc())
+    ).all()
+    for code_hash, _ in hashes:
+        tips = session.exec(
+            select(Tip.id, Tip.title, User.username)
+            .join(User, isouter=True)
+            .where(Tip.code_hash == code_hash)
+            .order_by(Tip.id)
+        ).all()
+        yield code_hash, tips
+
+
+def main(args, *, engine=None):
+    engine = engine or default_engine
+
+    parser = argparse.ArgumentParser("Backfill code hashes and report duplicates")
+    parser.add_argument("-b", "--batch-size", type=int, default=500)
+    parser.add_argument("-r", "--report-only", action="store_true")
+    args = parser.parse_args(args)
+
+    with Session(engine) as session:
+        if not args.report_only:
+            done = backfill(session, args.batch_size)
+            print(f"Backfilled {done} code hashes")
+
+        clusters = 0
+        for code_hash, tips in duplicate_clusters(session):
+            clusters += 1
+            print(f"{code_hash[:12]} ({len(tips)} copies)")
+            for tip_id, title, username in tips:
+                print(f"  #{tip_id} {title!r} by {username}")
+        print(f"{clusters} duplicate clusters")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,92 @@
+"""
+Startup warm-up and the dependency checks behind /healthz and /readyz
+
+The warm-up runs in a background thread so the worker starts answering
+/healthz right away, /readyz reports not ready until it has finished.
+"""
+import threading
+import time
+
+from sqlalchemy import text
+
+from .aws import check_bucket
+from .config import HEALTH_CHECK_TTL, WARMUP_DB_CONNECTIONS, WARMUP_RENDER
+from .render import check_renderer, warm_up_renderer
+
+
+def ping_db(bind):
+    with bind.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def open_db_connections(bind, count):
+    """Fill the pool with count connections by holding them all at once"""
+    connections = [bind.connect() for _ in range(count)]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+class Health:
+    """Results of the named checks, each with its latency and error if any"""
+
+    def __init__(self):
+        self.warmed_up = False
+        self.results = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def check(self, name, fn, *args, ttl=0):
+        """Run fn(*args) as check name, unless it ran less than ttl seconds ago"""
+        with self._lock:
+            checked = self._checked.get(name)
+            if checked is not None and time.monotonic() - checked < ttl:
+                return self.results[name]
+        start = time.perf_counter()
+        result = {"ok": True}
+        try:
+            fn(*args)
+        except Exception as exc:
+            result = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        with self._lock:
+            self.results[name] = result
+            self._checked[name] = time.monotonic()
+        return result
+
+    def dependencies(self, bind):
+        """The DB is pinged every time, the others are expensive(r) to check"""
+        return {
+            "db": self.check("db", ping_db, bind),
+            "renderer": self.check("renderer", check_renderer, ttl=HEALTH_CHECK_TTL),
+            "storage": self.check("storage", check_bucket, ttl=HEALTH_CHECK_TTL),
+        }
+
+    def warm_up(self, bind, *, connections=WARMUP_DB_CONNECTIONS, render=WARMUP_RENDER):
+        try:
+            self.check("db", open_db_connections, bind, connections)
+            # also imports carbon / selenium and boto3 ahead of the first /create
+            self.check("renderer", check_renderer)
+            self.check("storage", check_bucket)
+            if render:
+                self.check("warm_up_render", warm_up_renderer)
+        finally:
+            self.warmed_up = True
+
+    def start_warm_up(self, bind):
+        thread = threading.Thread(
+            target=self.warm_up, args=(bind,), name="warm-up", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def reset(self):
+        with self._lock:
+            self.warmed_up = False
+            self.results, self._checked = {}, {}
+
+
+health = Health()
@@ -1,13 +1,18 @@
-import sendgrid
-from sendgrid.helpers.mail import To, From, Mail
+import functools
 
-from .config import DEBUG, FROM_EMAIL, ADMIN_EMAIL, SENDGRID_API_KEY
+from .config import BASE_URL, DEBUG, FROM_EMAIL, ADMIN_EMAIL, SENDGRID_API_KEY
 
 ME = "me"
 ALL = "all"
 PYBITES = "Pybites"
 
-sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
+
+@functools.lru_cache
+def _sendgrid_client():
+    # imported and built on first use instead of at app startup
+    import sendgrid
+
+    return sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
 
 
 def send_email(
@@ -28,6 +33,8 @@ def send_email(
         print()
         return
 
+    from sendgrid.helpers.mail import To, From, Mail
+
     from_email = From(email=from_email, name=display_name)
 
     to_email = ADMIN_EMAIL if to_email == "me" else to_email
@@ -42,7 +49,7 @@ def send_email(
         html_content=body if html else None,
     )
 
-    response = sg.send(message)
+    response = _sendgrid_client().send(message)
 
     if str(response.status_code)[0] != "2":
         print(f"ERROR sending message, status_code {response.status_code}")
@@ -50,6 +57,12 @@ def send_email(
     return response
 
 
+def send_activation_email(email, activation_key):
+    subject = "Please verify your CodeImag.es account"
+    msg = f"{BASE_URL}/activate/{activation_key}"
+    return send_email(email, subject, msg)
+
+
 if __name__ == "__main__":
     subject = "new user (test message)"
     body = """test message with <a href='https://codechalleng.es/'>link</a>."""
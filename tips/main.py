@@ -1,57 +1,114 @@
 from datetime import datetime, timedelta
-import base64
-import os
+import hashlib
+import json
 from typing import Optional
 
-from fastapi import Depends, Form, FastAPI, HTTPException, Query, status, Request
+from fastapi import (
+    Depends,
+    Form,
+    FastAPI,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    status,
+    Request,
+    Response,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session
 from jose import JWTError, jwt
-from carbon.carbon import create_code_image
 
-from .aws import upload_to_s3
+from .assets import AssetFiles, url_for
+from .aws import delete_queue, s3_key
+from .bulk import CSV, NDJSON, stream_export
+from .cache import search_cache, search_stats
+from .compression import CompressionMiddleware
 from .config import (
-    BASE_URL,
-    CHROME_DRIVER,
-    USER_DIR,
     SECRET_KEY,
     ALGORITHM,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     FROM_EMAIL,
+    STATIC_DIR,
+    COMPRESSION_LEVEL,
+    COMPRESSION_MINIMUM_SIZE,
+    CREATE_DB_AND_TABLES,
+    DUPLICATE_CODE_POLICY,
+    IDEMPOTENCY_KEY_TTL,
+    IDEMPOTENCY_LEASE,
+    RENDER_QUEUE_TIMEOUT,
 )
 from .db import (
+    engine,
     get_session,
+    get_read_session,
     activate_user,
+    claim_idempotency_key,
     create_db_and_tables,
     create_user,
-    email_used_by_user,
     verify_password,
     delete_this_tip,
     get_user_by_username,
+    get_taken_usernames_and_emails,
     get_user_by_activation_key,
     get_tip_by_id,
-    get_tip_by_title,
+    get_tips_by_code_hash,
     get_tips_posted_today,
     get_all_tips,
-    create_new_tip,
+    NEWEST,
+    POPULAR,
+    image_in_use,
+    add_tip,
+    publish_tip,
+    tip_title_taken,
+    release_idempotency_key,
+    save_idempotent_response,
+    set_idempotent_response,
+    hash_code,
 )
+from .health import health
+from .render import RenderBusy, render_and_upload, sweep_scratch_dirs
+from .stats import EVENTS, stats_buffer
+from .suggest import suggest_index
 from .models import (
-    Tip,
     TipCreate,
+    TipRead,
     User,
     UserCreate,
     Token,
     TokenData,
 )
-from .mail import send_email
+from .mail import send_activation_email
+from .metrics import (
+    CREATE_TIP_STAGE_FAILURES,
+    CREATE_TIP_STAGE_SECONDS,
+    PrometheusMiddleware,
+    StageTimer,
+    latest_metrics,
+)
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    level=COMPRESSION_LEVEL,
+    # listings are cached compressed so it pays to compress them harder once
+    route_levels={"/": 9, "/tips": 9},
+    cached_paths={"/", "/tips"},
+)
+# outermost so it also sees responses served from the listing cache
+app.add_middleware(PrometheusMiddleware)
+app.mount("/static", AssetFiles(directory=STATIC_DIR), name="static")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 templates = Jinja2Templates(directory="templates")
+# resolve static paths to their fingerprinted names
+templates.env.globals["url_for"] = url_for
+
+SORT_PATTERN = f"^({NEWEST}|{POPULAR})$"
 
 
 def authenticate_user(session, username: str, password: str):
@@ -96,7 +153,41 @@ def get_current_user(
 
 @app.on_event("startup")
 def on_startup():
-    create_db_and_tables()
+    # Alembic owns the schema in production
+    if CREATE_DB_AND_TABLES:
+        create_db_and_tables()
+    sweep_scratch_dirs()
+    health.start_warm_up(engine)
+    suggest_index.start_build(engine)
+    stats_buffer.start(engine)
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    delete_queue.flush()
+    stats_buffer.flush(engine)
+
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness, the process is up. Shows the last check results."""
+    return {"status": "ok", "warmed_up": health.warmed_up, "checks": health.results}
+
+
+@app.get("/readyz", include_in_schema=False)
+def readyz(*, response: Response, session: Session = Depends(get_session)):
+    """Readiness, warmed up and the DB, renderer and storage are reachable"""
+    checks = health.dependencies(session.get_bind())
+    ready = health.warmed_up and all(check["ok"] for check in checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "warmed_up": health.warmed_up, "checks": checks}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    content, media_type = latest_metrics()
+    return Response(content, media_type=media_type)
 
 
 @app.get("/activate/{key}")
@@ -118,14 +209,74 @@ def activate(*, key: str, session: Session = Depends(get_session)):
     return {"account_active": True}
 
 
-@app.post("/create", status_code=201, response_model=Tip)
+def _same_look(existing_tip, tip):
+    """Would tip render to the same image as existing_tip?"""
+    existing = (existing_tip.language, existing_tip.background, existing_tip.theme)
+    new = ((tip.language or "").lower(), tip.background, tip.theme)
+    return existing == new and existing_tip.wt == tip.wt
+
+
+@app.post("/create", status_code=201, response_model=TipRead)
 def create_tip(
     *,
     tip: TipCreate,
+    response: Response,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
 ):
-    tips_posted_today = get_tips_posted_today(session, current_user)
+    if idempotency_key is None:
+        return _create_tip(tip, response, session, current_user)
+
+    request_hash = hashlib.sha256(tip.json(sort_keys=True).encode()).hexdigest()
+    claim, earlier = claim_idempotency_key(
+        session, current_user, idempotency_key, request_hash, IDEMPOTENCY_LEASE
+    )
+    if claim is None:
+        return _replay(earlier, request_hash)
+
+    try:
+        return _create_tip(tip, response, session, current_user, claim)
+    except HTTPException as exc:
+        if exc.status_code >= 500:
+            release_idempotency_key(session, claim)
+        else:
+            # retrying won't change the outcome
+            body = json.dumps({"detail": exc.detail})
+            save_idempotent_response(
+                session, claim, exc.status_code, body, IDEMPOTENCY_KEY_TTL
+            )
+        raise
+    except Exception:
+        release_idempotency_key(session, claim)
+        raise
+
+
+def _replay(earlier, request_hash):
+    """The response to a retry of an earlier request with the same key"""
+    if earlier is not None and earlier.request_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="This Idempotency-Key was used for another request",
+        )
+    if earlier is None or earlier.status_code is None:
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is in progress",
+            headers={"Retry-After": "5"},
+        )
+    return JSONResponse(
+        json.loads(earlier.response),
+        status_code=earlier.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def _create_tip(tip, response, session, current_user, claim=None):
+    timer = StageTimer(CREATE_TIP_STAGE_SECONDS, CREATE_TIP_STAGE_FAILURES)
+
+    with timer.stage("quota"):
+        tips_posted_today = get_tips_posted_today(session, current_user)
     if len(tips_posted_today) >= current_user.max_daily_snippets:
         msg = (
             f"Cannot exceed daily post rate of ({current_user.max_daily_snippets})"
@@ -133,39 +284,77 @@ def create_tip(
         )
         raise HTTPException(status_code=400, detail=msg)
 
-    if get_tip_by_title(session, tip.title, current_user) is not None:
+    with timer.stage("title"):
+        title_taken = tip_title_taken(session, current_user, tip.title)
+    if title_taken:
         raise HTTPException(status_code=400, detail="You already posted this tip")
 
-    # to not clash with other users
-    user_dir = USER_DIR.format(user_id=current_user.id)
-    os.makedirs(user_dir, exist_ok=True)
+    code_hash = hash_code(tip.code)
+    with timer.stage("duplicate"):
+        duplicates = get_tips_by_code_hash(session, code_hash)
+
+    url = None
+    if duplicates:
+        if DUPLICATE_CODE_POLICY == "reject":
+            raise HTTPException(
+                status_code=400, detail="This code snippet was already posted"
+            )
+        # same code rendered the same way, reuse the image
+        url = next(
+            (dup.url for dup in duplicates if dup.url and _same_look(dup, tip)), None
+        )
 
-    expected_carbon_outfile = os.path.join(user_dir, "carbon.png")
-    options = {
-        "language": tip.language,
-        "background": tip.background,
-        "theme": tip.theme,
-        "wt": tip.wt,
-        "driver_path": CHROME_DRIVER,
-        "destination": user_dir,
-        "disable-dev-shm": True,
-    }
-    create_code_image(tip.code, **options)
+    # end the read transaction, none may stay open (and hold a pooled
+    # connection) while we wait for a render lane, render and upload
+    session.commit()
+
+    rendered = url is None
+    if rendered:
+        try:
+            url = render_and_upload(
+                tip,
+                current_user.username,
+                timer=timer,
+                queue_timeout=RENDER_QUEUE_TIMEOUT,
+            )
+        except RenderBusy:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many images being rendered, please try again shortly",
+                headers={"Retry-After": str(RENDER_QUEUE_TIMEOUT)},
+            )
 
-    byte_str = f"{current_user.username}_{tip.title}".encode("utf-8")
-    key = base64.b64encode(byte_str)
-    encrypted_filename = key.decode("utf-8") + ".png"
+    try:
+        with timer.stage("insert"):
+            db_tip = add_tip(session, tip, current_user, code_hash, url)
+    except IntegrityError:
+        # unique (user_id, title), taken by a concurrent request meanwhile
+        if rendered:
+            _delete_image(url, code_hash)
+        raise HTTPException(status_code=400, detail="You already posted this tip")
 
-    unique_user_filename = os.path.join(user_dir, encrypted_filename)
-    os.rename(expected_carbon_outfile, unique_user_filename)
+    if claim is not None:
+        # committed together with the tip, retries can never post it twice
+        body = TipRead.from_orm(db_tip).json()
+        set_idempotent_response(claim, 201, body, IDEMPOTENCY_KEY_TTL)
+    with timer.stage("commit"):
+        try:
+            db_tip = publish_tip(session, db_tip)
+        except Exception:
+            if rendered:
+                _delete_image(url, code_hash)
+            raise
+    suggest_index.add(db_tip.title, current_user.username, db_tip.language)
 
-    url = upload_to_s3(unique_user_filename)
+    response.headers["Server-Timing"] = timer.server_timing()
+    return db_tip
 
-    os.remove(unique_user_filename)
-    os.rmdir(user_dir)
 
-    tip = create_new_tip(session, tip, url, current_user)
-    return tip
+def _delete_image(url, code_hash):
+    key = s3_key(url)
+    # tips imported with their urls preserved can point to other buckets
+    if key is not None:
+        delete_queue.put(key, code_hash)
 
 
 @app.delete("/{tip_id}")
@@ -178,50 +367,152 @@ def delete_tip(
     tip = get_tip_by_id(session, tip_id)
     if tip is None:
         raise HTTPException(status_code=404, detail="Tip not found")
-    if tip.user != current_user:
+    if tip.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Tip not owned by you")
     delete_this_tip(session, tip)
+    if tip.url and not image_in_use(session, tip.url, tip.code_hash):
+        _delete_image(tip.url, tip.code_hash)
+    suggest_index.remove(tip.title, current_user.username, tip.language)
     return {"ok": True}
 
 
-@app.get("/tips", response_model=list[Tip])
+@app.get("/tips", response_model=list[TipRead])
 def get_tips(
     *,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
-    session: Session = Depends(get_session),
+    language: Optional[str] = None,
+    user: Optional[str] = None,
+    sort: str = Query(default=NEWEST, pattern=SORT_PATTERN),
+    session: Session = Depends(get_read_session),
 ):
-    tips = get_all_tips(session, offset, limit)
+    tips = get_all_tips(
+        session, offset, limit, language=language, username=user, sort=sort
+    )
     return tips
 
 
-@app.get("/", response_model=list[Tip])
+@app.get("/tips/export")
+def export_tips(
+    *,
+    format: str = Query(default=NDJSON, pattern=f"^({NDJSON}|{CSV})$"),
+    since: Optional[datetime] = None,
+    session: Session = Depends(get_read_session),
+):
+    """All public tips, oldest first, streamed from a server side cursor"""
+    media_type = "text/csv" if format == CSV else "application/x-ndjson"
+    # the session is closed before the body is streamed, stream_export
+    # opens its own connection
+    return StreamingResponse(
+        stream_export(session.get_bind(), format, since=since),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tips.{format}"'},
+    )
+
+
+def _client_address(request):
+    # the Heroku router appends the address it got the request from,
+    # entries before it are whatever the client sent
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else None
+
+
+@app.post("/tips/{tip_id}/events/{event}", status_code=204, include_in_schema=False)
+def record_event(
+    request: Request,
+    tip_id: int,
+    event: str = Path(pattern=f"^({'|'.join(EVENTS)})$"),
+):
+    """
+    Beaconed by script.js, counted in memory and written in batches, once
+    per client, tip and event within STATS_DEDUPE_WINDOW
+    """
+    stats_buffer.record(tip_id, event, client=_client_address(request))
+
+
+@app.get("/users/{username}/tips", response_model=list[TipRead])
+def get_user_tips(
+    *,
+    username: str,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+    language: Optional[str] = None,
+    sort: str = Query(default=NEWEST, pattern=SORT_PATTERN),
+    session: Session = Depends(get_read_session),
+):
+    if get_user_by_username(session, username) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return get_all_tips(
+        session, offset, limit, language=language, username=username, sort=sort
+    )
+
+
+@app.get("/", response_model=list[TipRead])
 def get_tips_web(
     *,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
-    session: Session = Depends(get_session),
+    language: Optional[str] = None,
+    user: Optional[str] = None,
+    sort: str = Query(default=NEWEST, pattern=SORT_PATTERN),
+    session: Session = Depends(get_read_session),
     request: Request,
 ):
-    tips = get_all_tips(session, offset, limit)
+    tips = get_all_tips(
+        session, offset, limit, language=language, username=user, sort=sort
+    )
     return templates.TemplateResponse("tips.html", {"request": request, "tips": tips})
 
 
-@app.post("/search", response_model=list[Tip])
+@app.post("/search", response_model=list[TipRead])
 def get_tips_search(
     *,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
     request: Request,
     term: str = Form(...),
 ):
-    tips = get_all_tips(session, offset, limit, term=term)
+    # one normalized term for the cache key, the stats and the query
+    normalized = " ".join(term.lower().split())
+    key = (normalized, offset, limit)
+    tips = search_cache.get(key)
+    search_stats.record(normalized, hit=tips is not None)
+    if tips is None:
+        tips = get_all_tips(session, offset, limit, term=normalized)
+        search_cache.set(key, tips)
     return templates.TemplateResponse(
         "tips.html", {"request": request, "tips": tips, "term": term}
     )
 
 
+@app.get("/search/stats", include_in_schema=False)
+def get_search_stats(limit: int = Query(default=100, le=1000)):
+    return [
+        {"term": term, "searches": hits + misses, "hits": hits, "misses": misses}
+        for term, hits, misses in search_stats.top(limit)
+    ]
+
+
+@app.get("/suggest")
+def suggest(
+    *,
+    q: str = "",
+    limit: int = Query(default=10, le=50),
+    session: Session = Depends(get_read_session),
+    request: Request,
+):
+    matches = suggest_index.suggest(session.get_bind(), q, limit)
+    if request.headers.get("HX-Request"):
+        # <option>s for the search box's datalist
+        return templates.TemplateResponse(
+            "suggestions.html", {"request": request, "suggestions": matches}
+        )
+    return [{"text": text, "kind": kind} for kind, text in matches]
+
+
 @app.post("/token", response_model=Token)
 def login_for_access_token(
     *,
@@ -262,29 +553,24 @@ def signup(*, payload: UserCreate, session: Session = Depends(get_session)):
     password = payload.password
     password2 = payload.password2
 
-    user = get_user_by_username(session, username)
-    if user is not None:
-        raise HTTPException(
-            status_code=400,
-            detail="User already exists",
-        )
-
-    if email_used_by_user(session, email):
-        raise HTTPException(
-            status_code=400,
-            detail="Email already in use",
-        )
-
     if password != password2:
         raise HTTPException(
             status_code=400,
             detail="The two passwords should match",
         )
 
-    user = create_user(session, username, email, password)
-
-    subject = "Please verify your CodeImag.es account"
-    msg = f"{BASE_URL}/activate/{user.activation_key}"
-    send_email(email, subject, msg)
+    # the unique indexes on username and email do the checking, only a
+    # rejected insert looks up which one is taken, username first
+    try:
+        user = create_user(session, username, email, password)
+    except IntegrityError:
+        usernames, emails = get_taken_usernames_and_emails(session, [username], [email])
+        if username in usernames:
+            raise HTTPException(status_code=400, detail="User already exists")
+        if email in emails:
+            raise HTTPException(status_code=400, detail="Email already in use")
+        raise
+
+    send_activation_email(email, user.activation_key)
 
     return user
@@ -0,0 +1,219 @@
+"""
+Prometheus metrics, exposed on /metrics
+
+Under gunicorn every worker is a separate process, gunicorn.conf.py sets
+PROMETHEUS_MULTIPROC_DIR so all workers write their samples to shared
+files which are aggregated at scrape time.
+"""
+from contextlib import contextmanager
+import os
+import time
+
+from fastapi import HTTPException
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from starlette.routing import Match
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+HTTP_REQUESTS = Counter(
+    "codeimages_http_requests_total",
+    "HTTP requests by route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "codeimages_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "codeimages_http_requests_in_progress",
+    "HTTP requests currently being handled",
+    multiprocess_mode="livesum",
+)
+
+CREATE_TIP_STAGE_SECONDS = Histogram(
+    "codeimages_create_tip_stage_seconds",
+    "Duration of the stages of POST /create",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+CREATE_TIP_STAGE_FAILURES = Counter(
+    "codeimages_create_tip_stage_failures_total",
+    "Unexpected errors in POST /create by stage",
+    ["stage"],
+)
+
+RENDERS = Counter(
+    "codeimages_renders_total", "Code image renders by outcome", ["outcome"]
+)
+RENDER_SECONDS = Histogram(
+    "codeimages_render_duration_seconds",
+    "Code image render duration by render lane",
+    ["lane"],
+    buckets=STAGE_BUCKETS,
+)
+
+S3_UPLOADS = Counter(
+    "codeimages_s3_uploads_total", "S3 uploads by outcome", ["outcome"]
+)
+S3_DELETES = Counter(
+    "codeimages_s3_deletes_total", "S3 object deletes by outcome", ["outcome"]
+)
+S3_UPLOAD_BYTES = Counter("codeimages_s3_upload_bytes_total", "Bytes uploaded to S3")
+S3_UPLOAD_SECONDS = Histogram(
+    "codeimages_s3_upload_duration_seconds",
+    "S3 upload duration",
+    buckets=STAGE_BUCKETS,
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "codeimages_db_pool_connections",
+    "Open DB connections held by the pools",
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "codeimages_db_pool_checked_out",
+    "DB connections currently checked out of the pools",
+    multiprocess_mode="livesum",
+)
+
+CACHE_LOOKUPS = Counter(
+    "codeimages_cache_lookups_total",
+    "Cache lookups by cache and result (hit/miss), hit ratio in PromQL",
+    ["cache", "result"],
+)
+
+
+@contextmanager
+def track(counter, histogram):
+    """Count the outcome (ok/error) of a block and observe its duration"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        counter.labels(outcome="error").inc()
+        raise
+    else:
+        counter.labels(outcome="ok").inc()
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class StageTimer:
+    """
+    Time the named stages of a request
+
+    Durations are observed in histogram (labelled by stage) and collected
+    for a Server-Timing response header. Exceptions other than
+    HTTPException (validation errors we raise on purpose) increment the
+    failures counter for the stage they happened in.
+    """
+
+    def __init__(self, histogram, failures):
+        self.histogram = histogram
+        self.failures = failures
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except HTTPException:
+            raise
+        except Exception:
+            self.failures.labels(stage=name).inc()
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.timings[name] = duration
+            self.histogram.labels(stage=name).observe(duration)
+
+    def server_timing(self):
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}"
+            for name, duration in self.timings.items()
+        )
+
+
+def instrument_engine(engine):
+    """Track pool connections via SQLAlchemy pool events"""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTIONS.inc()
+
+    @event.listens_for(engine, "close")
+    def on_close(dbapi_connection, connection_record):
+        DB_POOL_CONNECTIONS.dec()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+
+def _route_label(scope):
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # responses served by middleware (listing cache) never reach the router
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    # don't let random 404 paths blow up the label cardinality
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = _route_label(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, route, status_code).inc()
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(duration)
+
+
+def latest_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,9 +1,25 @@
 from datetime import datetime
 from typing import List, Optional
 
-from sqlmodel import Column, DateTime, Field, Relationship, SQLModel
-
-from .config import FREE_DAILY_TIPS, PREMIUM_DAY_LIMIT
+from pydantic import validator
+from sqlmodel import (
+    Column,
+    DateTime,
+    Field,
+    ForeignKey,
+    Index,
+    Integer,
+    Relationship,
+    SQLModel,
+)
+
+from .config import (
+    FREE_DAILY_TIPS,
+    MAX_CODE_BYTES,
+    MAX_CODE_LINES,
+    MAX_LINE_LENGTH,
+    PREMIUM_DAY_LIMIT,
+)
 
 
 class UserBase(SQLModel):
@@ -13,6 +29,12 @@ class UserBase(SQLModel):
 
 
 class User(UserBase, table=True):
+    __table_args__ = (
+        Index("ix_user_username", "username", unique=True),
+        Index("ix_user_email", "email", unique=True),
+        Index("ix_user_activation_key", "activation_key"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     tips: List["Tip"] = Relationship(
         back_populates="user", sa_relationship_kwargs={"cascade": "all,delete"}
@@ -56,11 +78,19 @@ class TipBase(SQLModel):
 
 
 class Tip(TipBase, table=True):
+    __table_args__ = (
+        # filtered listings, newest first
+        Index("ix_tip_language_added", "language", "added"),
+        Index("ix_tip_user_id_added", "user_id", "added"),
+        # one title per user, enforced on create, and the unfiltered feed
+        Index("ix_tip_user_id_title", "user_id", "title", unique=True),
+        Index("ix_tip_added_id", "added", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    user: Optional[User] = Relationship(
-        back_populates="tips", sa_relationship_kwargs={"lazy": "subquery"}
-    )
+    # listings load the author explicitly, see db.get_all_tips
+    user: Optional[User] = Relationship(back_populates="tips")
     public: bool = True
     added: Optional[datetime] = Field(
         sa_column=Column(
@@ -68,10 +98,70 @@ class Tip(TipBase, table=True):
         )
     )
     url: Optional[str]
+    # sha256 of the normalized code, see db.hash_code
+    code_hash: Optional[str] = Field(default=None, index=True, max_length=64)
 
 
 class TipCreate(TipBase):
-    pass
+    @validator("code")
+    def code_renderable(cls, code):
+        # the render time grows with these, see render.render_cost
+        lines = code.splitlines()
+        if len(lines) > MAX_CODE_LINES:
+            raise ValueError(f"Code can have at most {MAX_CODE_LINES} lines")
+        if any(len(line) > MAX_LINE_LENGTH for line in lines):
+            raise ValueError(f"Code lines can be at most {MAX_LINE_LENGTH} characters")
+        if len(code.encode("utf-8")) > MAX_CODE_BYTES:
+            raise ValueError(f"Code can be at most {MAX_CODE_BYTES} bytes")
+        return code
+
+
+class TipRead(TipBase):
+    id: int
+    user_id: Optional[int]
+    public: bool
+    added: datetime
+    url: Optional[str]
+
+
+class TipStats(SQLModel, table=True):
+    """Popularity counters, written behind in batches by stats.StatsBuffer"""
+
+    __tablename__ = "tip_stats"
+    __table_args__ = (
+        # listings with sort=popular
+        Index("ix_tip_stats_score", "score", "tip_id"),
+    )
+
+    tip_id: Optional[int] = Field(
+        sa_column=Column(
+            Integer, ForeignKey("tip.id", ondelete="CASCADE"), primary_key=True
+        )
+    )
+    views: int = 0
+    copies: int = 0
+    downloads: int = 0
+    # weighted sum of the counters, see stats.WEIGHTS
+    score: int = 0
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """The (stored) outcome of a POST /create with an Idempotency-Key header"""
+
+    __tablename__ = "idempotency_key"
+
+    user_id: Optional[int] = Field(
+        sa_column=Column(
+            Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+        )
+    )
+    key: str = Field(primary_key=True, max_length=255)
+    # sha256 of the request body, a key can't be reused for another request
+    request_hash: str = Field(max_length=64)
+    # both None while the first request is in progress
+    status_code: Optional[int] = None
+    response: Optional[str] = None
+    expires: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
 
 
 class Token(SQLModel):
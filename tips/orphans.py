@@ -0,0 +1,125 @@
+"""
+Delete images in the S3 bucket that no tip points to
+
+    python -m tips.orphans [--dry-run] [--min-age 3600] [--batch-size 1000]
+
+The bucket listing and the tips' urls are both streamed in key order and
+merged, so memory stays flat whatever the bucket and table size. Images
+of deleted tips are normally removed right away (aws.DeleteQueue), this
+catches what that missed and renders whose tip never got committed.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import sys
+
+from sqlmodel import select
+
+from .aws import MAX_DELETE_BATCH, delete_from_s3, list_s3_objects, s3_key, s3_url
+from .db import engine as default_engine
+from .models import Tip
+
+
+def iter_image_keys(connection, fetch_size=1000):
+    """
+    Keys of the images tips point to in our bucket, sorted like S3 does.
+    Linked duplicates share an image, so keys can repeat.
+    """
+    order = Tip.url
+    if connection.dialect.name == "postgresql":
+        # byte order like the S3 listing, not the locale's
+        order = order.collate("C")
+    statement = (
+        select(Tip.url)
+        .where(Tip.url.startswith(s3_url(""), autoescape=True))
+        .order_by(order)
+    )
+    result = connection.execution_options(
+        stream_results=True, max_row_buffer=fetch_size
+    ).execute(statement)
+    for partition in result.scalars().partitions(fetch_size):
+        for url in partition:
+            yield s3_key(url)
+
+
+def find_orphans(objects, keys):
+    """
+    Yield the objects whose key isn't in keys, both sorted by key.
+    A single pass over both, like the merge in a merge sort.
+    """
+    keys = iter(keys)
+    key = next(keys, None)
+    for obj in objects:
+        while key is not None and key < obj["Key"]:
+            key = next(keys, None)
+        if obj["Key"] != key:
+            yield obj
+
+
+def sweep(objects, keys, *, delete, min_age, batch_size, dry_run=False, out=None):
+    """Delete orphans older than min_age seconds, return (count, bytes)"""
+    # renders upload before their tip is committed, leave those alone
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age)
+    count = size = 0
+    batch = []
+    for obj in find_orphans(objects, keys):
+        if obj["LastModified"] > cutoff:
+            continue
+        count += 1
+        size += obj["Size"]
+        if out is not None:
+            print(obj["Key"], file=out)
+        if dry_run:
+            continue
+        batch.append(obj["Key"])
+        if len(batch) >= batch_size:
+            delete(batch)
+            batch = []
+    if batch:
+        delete(batch)
+    return count, size
+
+
+def main(args, *, engine=None, list_objects=None, delete=None):
+    engine = engine or default_engine
+    list_objects = list_objects or list_s3_objects
+    delete = delete or delete_from_s3
+
+    parser = argparse.ArgumentParser("Delete S3 images no tip points to")
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="only list the orphans"
+    )
+    parser.add_argument(
+        "-a",
+        "--min-age",
+        type=int,
+        default=3600,
+        help="seconds, skip younger objects (renders in progress)",
+    )
+    parser.add_argument("-b", "--batch-size", type=int, default=MAX_DELETE_BATCH)
+    parser.add_argument("-v", "--verbose", action="store_true", help="list orphans")
+    args = parser.parse_args(args)
+
+    failed = []
+
+    def delete_batch(keys):
+        failed.extend(delete(keys))
+
+    with engine.connect() as connection:
+        count, size = sweep(
+            list_objects(),
+            iter_image_keys(connection),
+            delete=delete_batch,
+            min_age=args.min_age,
+            batch_size=min(args.batch_size, MAX_DELETE_BATCH),
+            dry_run=args.dry_run,
+            out=sys.stdout if args.verbose or args.dry_run else None,
+        )
+
+    verb = "Would delete" if args.dry_run else "Deleted"
+    print(f"{verb} {count - len(failed)} orphaned images ({size / 1e6:.1f} MB)")
+    for key in failed:
+        print(f"Failed to delete {key}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
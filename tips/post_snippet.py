@@ -1,20 +1,63 @@
 """
 Script to post a code snippet to Pybites Codeimag.es ->
 https://pybites-codeimages.herokuapp.com
+
+Interactive:
+
+    python -m tips.post_snippet [user] [password]
+
+Non-interactive, posting every file of a directory, a glob or the
+entries of a YAML/JSON manifest (see load_snippets):
+
+    python -m tips.post_snippet --batch snippets/ [--parallel 4]
 """
+import argparse
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+from pathlib import Path
 from pprint import pprint as pp
 import sys
+import time
 
 import requests
 from decouple import config
 
-CODEIMAGES_USER = config("CODEIMAGES_USER")
-CODEIMAGES_PASSWORD = config("CODEIMAGES_PASSWORD")
+CODEIMAGES_USER = config("CODEIMAGES_USER", default="")
+CODEIMAGES_PASSWORD = config("CODEIMAGES_PASSWORD", default="")
 DEBUG = config("DEBUG", cast=bool, default=False)
 LIVE_SITE = "https://pybites-codeimages.herokuapp.com"
 BASE_URL = "http://localhost:8000" if DEBUG else LIVE_SITE
 TOKEN_URL = f"{BASE_URL}/token"
 CREATE_TIP_URL = f"{BASE_URL}/create"
+TOKEN_CACHE = Path.home() / ".cache" / "codeimages" / "token.json"
+# renew cached tokens that expire within this many seconds
+TOKEN_LEEWAY = 60
+MANIFEST_SUFFIXES = (".json", ".yaml", ".yml")
+# file extension -> carbon language mode
+LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "text/typescript",
+    ".sh": "application/x-sh",
+    ".bash": "application/x-sh",
+    ".c": "text/x-csrc",
+    ".cpp": "text/x-c++src",
+    ".css": "css",
+    ".go": "go",
+    ".html": "htmlmixed",
+    ".java": "text/x-java",
+    ".json": "application/json",
+    ".md": "markdown",
+    ".rb": "ruby",
+    ".rs": "rust",
+    ".sql": "sql",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+SNIPPET_FIELDS = ("title", "description", "language", "background", "theme", "wt")
 
 
 def _write_multiline_input(action):
@@ -29,9 +72,9 @@ def _write_multiline_input(action):
     return "\n".join(lines)
 
 
-def get_token(user, password):
+def get_token(user, password, session=requests):
     payload = {"username": user, "password": password}
-    resp = requests.post(TOKEN_URL, data=payload)
+    resp = session.post(TOKEN_URL, data=payload)
     data = resp.json()
 
     if "access_token" not in data:
@@ -40,12 +83,180 @@ def get_token(user, password):
     return data["access_token"]
 
 
-def main(args):
+def _token_expiry(token):
+    """Read the exp claim, no need to verify the signature client side"""
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))["exp"]
+
+
+def get_cached_token(
+    user, password, session=requests, cache=TOKEN_CACHE, *, refresh=False
+):
+    """
+    Return the token cached on disk for user and site, fetch a new one if
+    expired or when refresh is set (e.g. the cached one was rejected)
+    """
+    cache = Path(cache)
     try:
-        user, password, *_ = args
-    except ValueError:
-        user, password = CODEIMAGES_USER, CODEIMAGES_PASSWORD
+        cached = json.loads(cache.read_text())
+        if (
+            not refresh
+            and cached["base_url"] == BASE_URL
+            and cached["user"] == user
+            and cached["exp"] > time.time() + TOKEN_LEEWAY
+        ):
+            return cached["access_token"]
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+
+    token = get_token(user, password, session)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "base_url": BASE_URL,
+        "user": user,
+        "access_token": token,
+        "exp": _token_expiry(token),
+    }
+    # the token grants access to the account, keep it private
+    fd = os.open(cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as f:
+        json.dump(data, f)
+    return token
+
+
+def _snippet_from_file(path, **fields):
+    path = Path(path)
+    snippet = {
+        "source": str(path),
+        "title": path.stem,
+        "code": path.read_text(),
+        "language": LANGUAGES.get(path.suffix.lower(), "auto"),
+    }
+    snippet.update({k: v for k, v in fields.items() if v is not None})
+    return snippet
+
+
+def _load_manifest(path):
+    with open(path) as f:
+        if path.suffix == ".json":
+            entries = json.load(f)
+        else:
+            import yaml
+
+            entries = yaml.safe_load(f)
+
+    snippets = []
+    for i, entry in enumerate(entries):
+        fields = {k: entry.get(k) for k in SNIPPET_FIELDS}
+        source = f"{path}[{i}]"
+        if "file" in entry:
+            snippets.append(_snippet_from_file(path.parent / entry["file"], **fields))
+        elif "code" in entry:
+            snippets.append({"source": source, "code": entry["code"], **fields})
+        else:
+            raise ValueError(f"{source}: entry has neither a file nor code")
+    return snippets
+
+
+def load_snippets(source):
+    """
+    Build the snippets to post from source, which is either:
+    - a directory: every (non hidden) file in it, recursively
+    - a glob pattern, e.g. "snippets/**/*.py"
+    - a .json/.yaml/.yml manifest: a list of entries with either a "file"
+      (relative to the manifest) or inline "code", plus optional title,
+      description, language, background, theme and wt
+
+    Titles default to the file name without extension and languages to
+    the one matching the file extension.
+    """
+    path = Path(source)
+    if path.is_dir():
+        files = sorted(
+            p for p in path.rglob("*") if p.is_file() and not p.name.startswith(".")
+        )
+    elif path.is_file() and path.suffix in MANIFEST_SUFFIXES:
+        return _load_manifest(path)
+    else:
+        files = sorted(
+            Path(p) for p in glob.glob(source, recursive=True) if os.path.isfile(p)
+        )
+    return [_snippet_from_file(p) for p in files]
+
 
+def post_snippet(session, token, snippet):
+    """Post one snippet, return its result for the summary"""
+    payload = {k: v for k, v in snippet.items() if k != "source" and v is not None}
+    result = {"source": snippet["source"], "title": snippet.get("title")}
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        resp = session.post(CREATE_TIP_URL, json=payload, headers=headers)
+        data = resp.json()
+    except (requests.RequestException, ValueError) as exc:
+        return {**result, "status": None, "error": repr(exc)}
+
+    result["status"] = resp.status_code
+    if resp.ok:
+        result["url"] = data.get("url")
+    else:
+        result["error"] = data.get("detail")
+    return result
+
+
+def post_snippets(session, token, snippets, parallel=4):
+    """Post snippets concurrently, return the results in input order"""
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(
+            executor.map(
+                lambda snippet: post_snippet(session, token, snippet), snippets
+            )
+        )
+
+
+def _http_session(parallel):
+    session = requests.Session()
+    # one keep-alive connection per worker thread
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=parallel)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def run_batch(user, password, source, *, parallel, summary, cache=TOKEN_CACHE):
+    try:
+        snippets = load_snippets(source)
+    except ValueError as exc:
+        sys.exit(str(exc))
+    if not snippets:
+        sys.exit(f"No snippets found in {source}")
+
+    with _http_session(parallel) as session:
+        token = get_cached_token(user, password, session, cache)
+        results = post_snippets(session, token, snippets, parallel)
+        rejected = [i for i, result in enumerate(results) if result["status"] == 401]
+        if rejected:
+            # the cached token is unexpired but no longer accepted (e.g. a
+            # rotated SECRET_KEY), get a new one and retry once
+            token = get_cached_token(user, password, session, cache, refresh=True)
+            retried = post_snippets(
+                session, token, [snippets[i] for i in rejected], parallel
+            )
+            for i, result in zip(rejected, retried):
+                results[i] = result
+
+    with open(summary, "w") as f:
+        json.dump(results, f, indent=2)
+
+    failed = [result for result in results if "error" in result]
+    print(f"Posted {len(results) - len(failed)} of {len(results)} snippets")
+    for result in failed:
+        print(f"  {result['source']}: {result['error']}")
+    print(f"Summary written to {summary}")
+    return len(failed) == 0
+
+
+def interactive(user, password):
     token = get_token(user, password)
 
     while True:
@@ -74,5 +285,31 @@ def main(args):
             break
 
 
+def main(args):
+    parser = argparse.ArgumentParser("Post code snippets to CodeImag.es")
+    parser.add_argument("user", nargs="?", default=CODEIMAGES_USER)
+    parser.add_argument("password", nargs="?", default=CODEIMAGES_PASSWORD)
+    parser.add_argument(
+        "-b", "--batch", metavar="SOURCE", help="directory, glob or manifest"
+    )
+    parser.add_argument("-p", "--parallel", type=int, default=4)
+    parser.add_argument("-s", "--summary", default="post_snippet_summary.json")
+    args = parser.parse_args(args)
+
+    if not args.user or not args.password:
+        sys.exit("Pass user and password or set CODEIMAGES_USER/CODEIMAGES_PASSWORD")
+
+    if args.batch is None:
+        interactive(args.user, args.password)
+    elif not run_batch(
+        args.user,
+        args.password,
+        args.batch,
+        parallel=args.parallel,
+        summary=args.summary,
+    ):
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,169 @@
+import base64
+from contextlib import contextmanager, nullcontext
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+
+from .aws import upload_to_s3
+from .config import (
+    CHROME_DRIVER,
+    FAST_RENDER_CONCURRENCY,
+    FAST_RENDER_MAX_COST,
+    SCRATCH_DIR,
+    SCRATCH_MAX_AGE,
+    SLOW_RENDER_CONCURRENCY,
+)
+from .metrics import RENDER_SECONDS, RENDERS, track
+
+
+def create_code_image(code, **options):
+    # pybites-carbon pulls in selenium, only pay for that when rendering
+    from carbon.carbon import create_code_image as carbon_create_code_image
+
+    return carbon_create_code_image(code, **options)
+
+
+SCRATCH_PREFIX = "codeimages-"
+
+
+class RenderBusy(Exception):
+    """No render slot freed up in time"""
+
+
+class RenderLane:
+    """At most concurrency renders at a time, per worker"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def acquire(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise RenderBusy(f"No {self.name} render slot free after {timeout}s")
+
+    def release(self):
+        self._slots.release()
+
+
+# big snippets take seconds to render, keep them from holding up small ones
+FAST_LANE = RenderLane("fast", FAST_RENDER_CONCURRENCY)
+SLOW_LANE = RenderLane("slow", SLOW_RENDER_CONCURRENCY)
+
+
+def render_cost(code):
+    """
+    Estimated render cost of code, roughly in 80 column lines: the image
+    grows with the number of lines and the longest one, highlighting with
+    the amount of code
+    """
+    lines = code.splitlines() or [""]
+    longest = max(len(line) for line in lines)
+    return len(lines) * max(longest, 80) / 80 + len(code.encode("utf-8")) / 2000
+
+
+def render_lane(code):
+    return FAST_LANE if render_cost(code) <= FAST_RENDER_MAX_COST else SLOW_LANE
+
+
+@contextmanager
+def scratch_dir():
+    """A fresh directory per render job, removed even if the job fails"""
+    path = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=SCRATCH_DIR)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def sweep_scratch_dirs(max_age=SCRATCH_MAX_AGE):
+    """
+    Remove scratch dirs left behind by crashed workers, return the count.
+    Only dirs older than max_age seconds go, other workers may be using
+    the younger ones. Creates SCRATCH_DIR if it doesn't exist yet.
+    """
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(SCRATCH_DIR) as entries:
+        for entry in entries:
+            if not entry.name.startswith(SCRATCH_PREFIX) or not entry.is_dir():
+                continue
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+    return removed
+
+
+def check_renderer():
+    """Raise if carbon can't be imported or chromedriver isn't there"""
+    from carbon.carbon import create_code_image  # noqa: F401
+
+    if not os.access(CHROME_DRIVER, os.X_OK):
+        raise FileNotFoundError(f"No chromedriver at {CHROME_DRIVER}")
+
+
+def warm_up_renderer():
+    """Render a snippet without uploading it, so Chrome's files are cached"""
+    with scratch_dir() as workdir:
+        create_code_image(
+            "print('hello world')",
+            language="python",
+            driver_path=CHROME_DRIVER,
+            destination=workdir,
+            **{"disable-dev-shm": True},
+        )
+
+
+def image_filename(username, title):
+    """
+    A new S3 key for every upload: linked duplicates share images, so a
+    user reposting a deleted title must never overwrite (or have a queued
+    delete remove) an image other tips still show
+    """
+    byte_str = f"{username}_{title}".encode("utf-8")
+    key = base64.b64encode(byte_str)
+    return f"{key.decode('utf-8')}-{secrets.token_hex(8)}.png"
+
+
+def render_and_upload(tip, username, *, timer=None, queue_timeout=None):
+    """
+    Render tip with carbon in its own scratch dir, upload the image to S3
+    and return its url. Stages are timed if a metrics.StageTimer is given.
+
+    The render waits for a slot in the lane matching its cost, raises
+    RenderBusy if none frees up within queue_timeout seconds.
+    """
+
+    def stage(name):
+        return timer.stage(name) if timer is not None else nullcontext()
+
+    with scratch_dir() as workdir:
+        expected_carbon_outfile = os.path.join(workdir, "carbon.png")
+        options = {
+            "language": tip.language,
+            "background": tip.background,
+            "theme": tip.theme,
+            "wt": tip.wt,
+            "driver_path": CHROME_DRIVER,
+            "destination": workdir,
+            "disable-dev-shm": True,
+        }
+        lane = render_lane(tip.code)
+        with stage("queue"):
+            lane.acquire(queue_timeout)
+        render_seconds = RENDER_SECONDS.labels(lane=lane.name)
+        try:
+            with stage("render"), track(RENDERS, render_seconds):
+                create_code_image(tip.code, **options)
+        finally:
+            lane.release()
+
+        filename = os.path.join(workdir, image_filename(username, tip.title))
+        with stage("rename"):
+            os.rename(expected_carbon_outfile, filename)
+
+        with stage("upload"):
+            return upload_to_s3(filename)
@@ -0,0 +1,241 @@
+"""
+Render and upload the images of existing tips again, e.g. after a Chrome
+or theme fix or when moving buckets
+
+    python -m tips.rerender [--theme seti] [--language python]
+        [--since 2022-01-01] [--until 2023-01-01] [--user bob] [--workers 4]
+
+Tips are processed in id order, batch by batch, across a process pool.
+The new urls of a batch are written in one executemany update and the
+last finished id and the ids that failed are recorded in the checkpoint
+file, rerunning the same command after a crash resumes from there and
+retries the failures first. The file is removed once a run completes
+without failures.
+
+The checkpoint file is named after the filters by default and stores
+them, resuming with a checkpoint of other filters is refused.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import bindparam, update
+from sqlmodel import select
+
+from .db import engine as default_engine
+from .models import Tip, User
+from .render import render_and_upload
+
+RENDER_COLUMNS = ("id", "title", "code", "language", "background", "theme", "wt")
+
+
+def select_tips(
+    *,
+    ids=None,
+    after_id=0,
+    limit=None,
+    theme=None,
+    language=None,
+    since=None,
+    until=None,
+    username=None,
+):
+    """Build the statement selecting the render input of the matching tips"""
+    tip_table, user_table = Tip.__table__, User.__table__
+    columns = [tip_table.c[name] for name in RENDER_COLUMNS]
+    statement = (
+        select(*columns, user_table.c.username)
+        .select_from(tip_table.join(user_table))
+        .where(tip_table.c.id > after_id)
+        .order_by(tip_table.c.id)
+        .limit(limit)
+    )
+    if ids is not None:
+        statement = statement.where(tip_table.c.id.in_(ids))
+    if theme is not None:
+        statement = statement.where(tip_table.c.theme == theme)
+    if language is not None:
+        statement = statement.where(tip_table.c.language == language.lower())
+    if since is not None:
+        statement = statement.where(tip_table.c.added >= since)
+    if until is not None:
+        statement = statement.where(tip_table.c.added < until)
+    if username is not None:
+        statement = statement.where(user_table.c.username == username)
+    return statement
+
+
+def rerender_one(job):
+    """Process pool worker: render and upload one tip, return its new url"""
+    return render_and_upload(SimpleNamespace(**job), job["username"])
+
+
+def _filter_values(filters):
+    """The filters as JSON values, datetimes in ISO format"""
+    return {
+        name: value.isoformat() if isinstance(value, datetime) else value
+        for name, value in sorted(filters.items())
+        if value is not None
+    }
+
+
+def default_checkpoint(filters):
+    """Checkpoint filename derived from the filters, one per filter set"""
+    values = json.dumps(_filter_values(filters), sort_keys=True)
+    return f"rerender-{hashlib.sha1(values.encode()).hexdigest()[:12]}.checkpoint"
+
+
+def _read_checkpoint(path, filters):
+    """(last id, failed ids), raises ValueError if written for other filters"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0, []
+    if state.get("filters", {}) != _filter_values(filters):
+        raise ValueError(
+            f"Checkpoint {path} was written for filters {state.get('filters')}, "
+            "remove it or pass another --checkpoint"
+        )
+    return state["last_id"], state.get("failed", [])
+
+
+def _write_checkpoint(path, filters, last_id, failed):
+    # write + rename so a crash never leaves a truncated checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(
+            {"filters": _filter_values(filters), "last_id": last_id, "failed": failed},
+            f,
+        )
+    os.replace(tmp, path)
+
+
+def _update_urls(engine, urls):
+    statement = (
+        update(Tip.__table__)
+        .where(Tip.__table__.c.id == bindparam("tip_id"))
+        .values(url=bindparam("new_url"))
+    )
+    with engine.begin() as connection:
+        connection.execute(
+            statement,
+            [{"tip_id": tip_id, "new_url": url} for tip_id, url in urls.items()],
+        )
+
+
+def rerender(engine, executor, *, batch_size=50, checkpoint=None, **filters):
+    """
+    Re-render the tips matching filters (see select_tips), return
+    (rendered count, [(tip id, title, error), ...] failures). The tips
+    that failed in an earlier run of the checkpoint are retried first.
+    """
+    last_id, retry = _read_checkpoint(checkpoint, filters) if checkpoint else (0, [])
+    rendered = 0
+    failures = []
+
+    def run(statement):
+        nonlocal rendered
+        with engine.connect() as connection:
+            jobs = [dict(row) for row in connection.execute(statement).mappings()]
+
+        futures = {executor.submit(rerender_one, job): job for job in jobs}
+        urls = {}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                urls[job["id"]] = future.result()
+            except Exception as exc:
+                failures.append((job["id"], job["title"], repr(exc)))
+
+        if urls:
+            _update_urls(engine, urls)
+        rendered += len(urls)
+        return jobs
+
+    def save():
+        if checkpoint:
+            failed = sorted(tip_id for tip_id, _, _ in failures)
+            _write_checkpoint(checkpoint, filters, last_id, failed)
+
+    for start in range(0, len(retry), batch_size):
+        run(select_tips(ids=retry[start : start + batch_size], **filters))
+    if retry:
+        save()
+
+    while True:
+        jobs = run(select_tips(after_id=last_id, limit=batch_size, **filters))
+        if not jobs:
+            return rendered, failures
+        last_id = jobs[-1]["id"]
+        save()
+
+
+def main(args, *, engine=None, executor=None):
+    engine = engine or default_engine
+
+    parser = argparse.ArgumentParser("Re-render and upload images of existing tips")
+    parser.add_argument("-t", "--theme")
+    parser.add_argument("-l", "--language")
+    parser.add_argument(
+        "-s", "--since", type=datetime.fromisoformat, help="added on or after"
+    )
+    parser.add_argument(
+        "-u", "--until", type=datetime.fromisoformat, help="added before"
+    )
+    parser.add_argument("--user", help="username")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-b", "--batch-size", type=int, default=50)
+    parser.add_argument(
+        "-c", "--checkpoint", help="default: rerender-<hash of the filters>.checkpoint"
+    )
+    args = parser.parse_args(args)
+
+    filters = dict(
+        theme=args.theme,
+        language=args.language,
+        since=args.since,
+        until=args.until,
+        username=args.user,
+    )
+    checkpoint = args.checkpoint or default_checkpoint(filters)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+
+    start = time.perf_counter()
+    try:
+        rendered, failures = rerender(
+            engine,
+            executor,
+            batch_size=args.batch_size,
+            checkpoint=checkpoint,
+            **filters,
+        )
+    except ValueError as exc:
+        parser.error(str(exc))
+    finally:
+        if own_executor:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    if not failures and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    rate = rendered / elapsed if elapsed else 0
+    print(f"Rendered {rendered} tips in {elapsed:.1f}s ({rate:.2f} tips/s)")
+    print(f"{len(failures)} failures")
+    for tip_id, title, error in failures:
+        print(f"  #{tip_id} {title!r}: {error}")
+    if failures:
+        print(f"Run the same command again to retry them ({checkpoint})")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
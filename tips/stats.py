@@ -0,0 +1,146 @@
+"""
+Write-behind popularity counters
+
+Views, code copies and image downloads are counted in memory per worker
+and added to the tip_stats table every STATS_FLUSH_INTERVAL seconds, in
+one multi-row upsert per 1000 tips. Counts a worker hasn't flushed when
+it's killed are lost, good enough for a ranking. The endpoint is public,
+so a client's repeats of an event for a tip are ignored for
+STATS_DEDUPE_WINDOW seconds.
+"""
+import threading
+import time
+
+from sqlalchemy import select
+
+from .cache import TTLCache
+from .config import (
+    STATS_DEDUPE_SIZE,
+    STATS_DEDUPE_WINDOW,
+    STATS_FLUSH_INTERVAL,
+    STATS_MAX_TIPS,
+)
+from .db import dialect_insert
+from .models import Tip, TipStats
+
+EVENTS = ("views", "copies", "downloads")
+# a copy or download says more about a tip than scrolling past it
+WEIGHTS = {"views": 1, "copies": 10, "downloads": 10}
+UPSERT_BATCH = 1000
+
+
+def upsert_stats(connection, rows):
+    """Add rows of counter deltas to tip_stats, creating missing rows"""
+    table = TipStats.__table__
+    insert = dialect_insert(connection.dialect)
+    for i in range(0, len(rows), UPSERT_BATCH):
+        statement = insert(table).values(rows[i : i + UPSERT_BATCH])
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.tip_id],
+            set_={
+                name: table.c[name] + statement.excluded[name]
+                for name in (*EVENTS, "score")
+            },
+        )
+        connection.execute(statement)
+
+
+class StatsBuffer:
+    def __init__(
+        self,
+        interval=STATS_FLUSH_INTERVAL,
+        max_tips=STATS_MAX_TIPS,
+        dedupe_window=STATS_DEDUPE_WINDOW,
+        dedupe_size=STATS_DEDUPE_SIZE,
+    ):
+        self.interval = interval
+        self.max_tips = max_tips
+        # tip id -> {event: count}
+        self._counts = {}
+        # (client, tip id, event) recently counted
+        self._seen = TTLCache(dedupe_size, dedupe_window, name="stats_dedupe")
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, tip_id, event, client=None):
+        """Count event for tip_id, False if dropped (a repeat or no room)"""
+        if client is not None:
+            key = (client, tip_id, event)
+            if self._seen.get(key):
+                return False
+            self._seen.set(key, True)
+        with self._lock:
+            counts = self._counts.get(tip_id)
+            if counts is None:
+                # ids aren't checked until the flush, don't let bogus ones pile up
+                if len(self._counts) >= self.max_tips:
+                    return False
+                counts = self._counts[tip_id] = dict.fromkeys(EVENTS, 0)
+            counts[event] += 1
+        return True
+
+    def _take(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+    def _put_back(self, counts):
+        with self._lock:
+            for tip_id, deltas in counts.items():
+                current = self._counts.setdefault(tip_id, dict.fromkeys(EVENTS, 0))
+                for event, delta in deltas.items():
+                    current[event] += delta
+
+    def flush(self, bind):
+        """Write the counts so far, return the number of tips updated"""
+        counts = self._take()
+        if not counts:
+            return 0
+        try:
+            with bind.begin() as connection:
+                # deleted tips, or ids that never existed
+                existing = connection.execute(
+                    select(Tip.__table__.c.id).where(Tip.__table__.c.id.in_(counts))
+                ).scalars()
+                rows = [
+                    dict(
+                        tip_id=tip_id,
+                        **counts[tip_id],
+                        score=sum(
+                            WEIGHTS[event] * delta
+                            for event, delta in counts[tip_id].items()
+                        ),
+                    )
+                    # same order in every worker, so concurrent upserts
+                    # can't deadlock on each other's rows
+                    for tip_id in sorted(existing)
+                ]
+                if rows:
+                    upsert_stats(connection, rows)
+        except Exception:
+            self._put_back(counts)
+            raise
+        return len(rows)
+
+    def start(self, bind):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, args=(bind,), name="stats-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, bind):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush(bind)
+            except Exception:
+                # kept in memory, the next flush tries again
+                pass
+
+    def clear(self):
+        self._take()
+        self._seen.clear()
+
+
+stats_buffer = StatsBuffer()
@@ -0,0 +1,134 @@
+from bisect import bisect_left, insort
+import threading
+import time
+
+from sqlmodel import Session, select
+
+from .config import SUGGEST_MAX_AGE
+from .models import Tip, User
+
+TITLE = "title"
+USER = "user"
+LANGUAGE = "language"
+
+
+class SuggestIndex:
+    """
+    Sorted in-memory index of tip titles, usernames and languages for
+    prefix lookups with bisect.
+
+    Built from the database in a background thread at startup and kept up
+    to date with add and remove on create/delete. Other workers' writes are
+    picked up by rebuilding in the background once the index is older than
+    max_age seconds, lookups keep using the old entries meanwhile.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        # (lowercased text, kind, text), sorted
+        self._entries = []
+        # (kind, text) -> number of tips it appears in
+        self._counts = {}
+        self._built = None
+        self._lock = threading.Lock()
+        # held while a build runs, there's never more than one
+        self._building = threading.Lock()
+
+    def _stale(self):
+        return self._built is None or time.monotonic() - self._built > self.max_age
+
+    def build(self, bind):
+        with Session(bind) as session:
+            rows = session.exec(
+                select(Tip.title, User.username, Tip.language).join(User, isouter=True)
+            ).all()
+        counts = {}
+        for row in rows:
+            for item in _items(*row):
+                counts[item] = counts.get(item, 0) + 1
+        entries = sorted((text.lower(), kind, text) for kind, text in counts)
+        with self._lock:
+            self._entries, self._counts = entries, counts
+            self._built = time.monotonic()
+
+    def _build_and_release(self, bind):
+        try:
+            self.build(bind)
+        finally:
+            self._building.release()
+
+    def start_build(self, bind):
+        """Build in a background thread, None if a build is running already"""
+        if not self._building.acquire(blocking=False):
+            return None
+        thread = threading.Thread(
+            target=self._build_and_release,
+            args=(bind,),
+            name="suggest-build",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def add(self, title, username, language):
+        with self._lock:
+            if self._built is None:
+                return
+            for kind, text in _items(title, username, language):
+                count = self._counts.get((kind, text), 0)
+                self._counts[(kind, text)] = count + 1
+                if count == 0:
+                    insort(self._entries, (text.lower(), kind, text))
+
+    def remove(self, title, username, language):
+        with self._lock:
+            if self._built is None:
+                return
+            for kind, text in _items(title, username, language):
+                count = self._counts.get((kind, text), 0)
+                if count > 1:
+                    self._counts[(kind, text)] = count - 1
+                elif count == 1:
+                    del self._counts[(kind, text)]
+                    entry = (text.lower(), kind, text)
+                    i = bisect_left(self._entries, entry)
+                    if i < len(self._entries) and self._entries[i] == entry:
+                        del self._entries[i]
+
+    def suggest(self, bind, prefix, limit=10):
+        """[(kind, text), ...] starting with prefix, case insensitive"""
+        if self._built is None:
+            # the startup build failed or didn't run, one request builds it
+            # and the others get no suggestions instead of waiting for it
+            if self._building.acquire(blocking=False):
+                self._build_and_release(bind)
+        elif self._stale():
+            self.start_build(bind)
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        with self._lock:
+            i = bisect_left(self._entries, (prefix,))
+            matches = []
+            for key, kind, text in self._entries[i:]:
+                if not key.startswith(prefix) or len(matches) == limit:
+                    break
+                matches.append((kind, text))
+        return matches
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._counts = [], {}
+            self._built = None
+
+
+def _items(title, username, language):
+    items = [(TITLE, title)]
+    if username:
+        items.append((USER, username))
+    if language:
+        items.append((LANGUAGE, language))
+    return items
+
+
+suggest_index = SuggestIndex(SUGGEST_MAX_AGE)
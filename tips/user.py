@@ -1,21 +1,187 @@
+"""
+Create users
+
+    python -m tips.user -u bob -e bob@example.com -p secret
+    python -m tips.user --bulk cohort.csv [--workers 4] [--no-email]
+
+A bulk file is a CSV with username,email,password columns or a JSON
+list of objects with those keys. Rows are validated against the
+database in one query per batch, passwords are hashed across a process
+pool and every batch is inserted in one transaction. Activation emails
+of the created users are sent from a background thread pool.
+"""
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import json
+import os
 import sys
 
 from sqlmodel import Session
 
-from .db import engine as default_engine, create_user, get_user_by_username
+from .db import (
+    engine as default_engine,
+    create_user,
+    get_password_hash,
+    get_taken_usernames_and_emails,
+    get_user_by_username,
+    new_user,
+)
+from .mail import send_activation_email
+
+FIELDS = ("username", "email", "password")
+EMAIL_WORKERS = 4
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return list(csv.DictReader(f))
+
+
+def _validate(batch, taken_usernames, taken_emails, seen):
+    """Split batch into valid (row number, row) pairs and failures"""
+    valid, failures = [], []
+    for row_number, row in batch:
+        username, email = row.get("username"), row.get("email")
+        missing = [field for field in FIELDS if not row.get(field)]
+        if missing:
+            error = f"missing {', '.join(missing)}"
+        elif username in taken_usernames or username in seen["usernames"]:
+            error = "User already exists"
+        elif email in taken_emails or email in seen["emails"]:
+            error = "Email already in use"
+        else:
+            seen["usernames"].add(username)
+            seen["emails"].add(email)
+            valid.append((row_number, row))
+            continue
+        failures.append((row_number, username, error))
+    return valid, failures
+
+
+def create_users(engine, rows, executor, *, batch_size=100, email_executor=None):
+    """
+    Create users from rows (dicts with FIELDS), return (created users,
+    [(row number, username, error), ...] failures). Activation emails are
+    only sent when an email_executor is given.
+    """
+    created, failures = [], []
+    seen = {"usernames": set(), "emails": set()}
+    numbered = list(enumerate(rows, start=1))
+    email_futures = []
+
+    for start in range(0, len(numbered), batch_size):
+        batch = numbered[start : start + batch_size]
+        with Session(engine) as session:
+            taken_usernames, taken_emails = get_taken_usernames_and_emails(
+                session,
+                [row.get("username") for _, row in batch],
+                [row.get("email") for _, row in batch],
+            )
+            valid, batch_failures = _validate(
+                batch, taken_usernames, taken_emails, seen
+            )
+            failures.extend(batch_failures)
+            if not valid:
+                continue
 
+            # bcrypt is cpu bound and slow by design, spread it over processes
+            hashes = executor.map(
+                get_password_hash, [row["password"] for _, row in valid]
+            )
+            users = [
+                new_user(row["username"], row["email"], hashed)
+                for (_, row), hashed in zip(valid, hashes)
+            ]
+            try:
+                session.bulk_save_objects(users)
+                session.commit()
+            except Exception as exc:
+                session.rollback()
+                failures.extend(
+                    (row_number, row["username"], repr(exc))
+                    for row_number, row in valid
+                )
+                continue
 
-def main(args, *, engine=None):
+        created.extend(users)
+        if email_executor is not None:
+            email_futures.extend(
+                (
+                    row_number,
+                    user,
+                    email_executor.submit(
+                        send_activation_email, user.email, user.activation_key
+                    ),
+                )
+                for (row_number, _), user in zip(valid, users)
+            )
+
+    for row_number, user, future in email_futures:
+        try:
+            future.result()
+        except Exception as exc:
+            failures.append((row_number, user.username, f"activation email: {exc!r}"))
+    return created, sorted(failures)
+
+
+def bulk(engine, path, *, workers, batch_size, send_emails, executor=None):
+    rows = read_rows(path)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        with ThreadPoolExecutor(max_workers=EMAIL_WORKERS) as email_executor:
+            created, failures = create_users(
+                engine,
+                rows,
+                executor,
+                batch_size=batch_size,
+                email_executor=email_executor if send_emails else None,
+            )
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    print(f"Created {len(created)} of {len(rows)} users")
+    for row_number, username, error in failures:
+        print(f"Row {row_number} ({username}): {error}")
+    return not failures
+
+
+def main(args, *, engine=None, executor=None):
     engine = engine or default_engine
 
     parser = argparse.ArgumentParser("Create a user")
-    parser.add_argument("-u", "--username", required=True)
-    parser.add_argument("-e", "--email", required=True)
-    parser.add_argument("-p", "--password", required=True)
+    parser.add_argument("-u", "--username")
+    parser.add_argument("-e", "--email")
+    parser.add_argument("-p", "--password")
+    parser.add_argument("--bulk", metavar="FILE", help="CSV or JSON file of users")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-b", "--batch-size", type=int, default=100)
+    parser.add_argument(
+        "--no-email", action="store_true", help="don't send activation emails"
+    )
 
     args = parser.parse_args(args)
 
+    if args.bulk is not None:
+        if not bulk(
+            engine,
+            args.bulk,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            send_emails=not args.no_email,
+            executor=executor,
+        ):
+            sys.exit(1)
+        return
+
+    if not (args.username and args.email and args.password):
+        parser.error("the following arguments are required: -u, -e, -p")
+
     with Session(engine) as session:
         user = get_user_by_username(session, args.username)
         if user is not None: